@@ -0,0 +1,115 @@
+import os
+import sys
+from calendar import monthrange
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# The ERA5 variable table lives with the extraction engine
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'environment_conditions'))
+from era5_utils import VARIABLES, profile_levels
+
+# West Sumatra box on the 0.25 degree ERA5 grid, north to south like the real files
+latitudes = np.arange(5.0, -5.01, -0.25)
+longitudes = np.arange(95.0, 105.01, 0.25)
+
+# Stations are scattered over the land part of the box
+station_box = {'latitude': (-3.0, 1.0), 'longitude': (98.5, 102.0)}
+
+
+# Function to construct the path of a synthetic monthly file, named like the ERA5 replica on Gadi
+def get_fixture_file(era5_dir, var, year, month):
+    config = VARIABLES[var]
+    days = monthrange(year, month)[1]
+    file_name = f"{var}_era5_oper_{config['stream']}_{year}{month:02d}01-{year}{month:02d}{days:02d}.nc"
+    return os.path.join(era5_dir, config['level_type'], 'reanalysis', var, str(year), file_name)
+
+
+# Function to draw plausible hourly values of a variable, shaped (time[, level], latitude, longitude)
+def synthetic_field(var, shape, rng):
+    if var == 'cape':
+        return rng.gamma(1.5, 400.0, shape)
+    if var == 'cin':
+        # CIN is undefined (NaN) where there is no CAPE, which is most hours in ERA5
+        values = rng.gamma(1.0, 50.0, shape)
+        values[rng.random(shape) < 0.6] = np.nan
+        return values
+    if var == 'tcwv':
+        return rng.normal(50.0, 6.0, shape)
+    if var == 't':
+        # Rough tropical profile: about 300 K at 1000 hPa, 200 K at 100 hPa
+        level_t = 200.0 + 100.0 * np.log(np.asarray(profile_levels) / 100.0) / np.log(10.0)
+        return level_t[:, None, None] + rng.normal(0.0, 2.0, shape)
+    if var == 'r':
+        return rng.uniform(0.0, 100.0, shape)
+    return rng.normal(0.0, 6.0, shape)  # u, v
+
+
+# Function to write one month of a synthetic ERA5 variable (existing files are kept)
+def make_era5_month(era5_dir, var, year, month, seed=0):
+    nc_file = get_fixture_file(era5_dir, var, year, month)
+    if os.path.exists(nc_file):
+        return nc_file
+
+    rng = np.random.default_rng([seed, year, month, sorted(VARIABLES).index(var)])
+    time = pd.date_range(f"{year}-{month:02d}-01", periods=monthrange(year, month)[1] * 24, freq='h')
+    coords = {'time': time, 'latitude': latitudes, 'longitude': longitudes}
+    dims = ('time', 'latitude', 'longitude')
+    shape = (len(time), len(latitudes), len(longitudes))
+    if VARIABLES[var]['level_type'] == 'pressure-levels':
+        coords['level'] = np.asarray(profile_levels, dtype='int32')
+        dims = ('time', 'level', 'latitude', 'longitude')
+        shape = (len(time), len(profile_levels), len(latitudes), len(longitudes))
+
+    values = synthetic_field(var, shape, rng).astype('float32')
+    os.makedirs(os.path.dirname(nc_file), exist_ok=True)
+    xr.Dataset({var: (dims, values)}, coords=coords).to_netcdf(nc_file + '.tmp', format='NETCDF4')
+    os.replace(nc_file + '.tmp', nc_file)
+    return nc_file
+
+
+# Function to write synthetic monthly ERA5 files of several variables and years
+def make_era5(era5_dir, years, variables=('cape', 'cin', 'tcwv', 't', 'r', 'u', 'v'), seed=0):
+    """Files follow the real directory layout and naming, so era5_utils reads them once
+    `era5_utils.era5_dir` points at `era5_dir`. Pressure-level files hold the profile
+    levels only. Files already present are reused."""
+    for var in variables:
+        for year in years:
+            for month in range(1, 13):
+                make_era5_month(era5_dir, var, year, month, seed)
+
+
+# Function to write a synthetic station list in the stations_coordinate.csv layout
+def make_stations(station_file, n_stations, seed=0):
+    rng = np.random.default_rng(seed)
+    stations = pd.DataFrame({
+        'station': [f"ARG Synthetic {i:04d}" for i in range(n_stations)],
+        'longitude': np.round(rng.uniform(*station_box['longitude'], n_stations), 6),
+        'latitude': np.round(rng.uniform(*station_box['latitude'], n_stations), 6),
+    })
+    os.makedirs(os.path.dirname(os.path.abspath(station_file)), exist_ok=True)
+    stations.to_csv(station_file, index=False)
+    return stations
+
+
+# Function to write one synthetic 10-minute rainfall file per station (existing files are kept)
+def make_10m_files(input_dir, stations, years, seed=0):
+    """Columns date, station, rr as in the logger exports: mostly dry records, gamma-distributed
+    rain in about 3% of them, and about 2% of the records missing."""
+    os.makedirs(input_dir, exist_ok=True)
+    dates = pd.date_range(f"{years[0]}-01-01 00:10", f"{years[-1]}-12-31 23:50", freq='10min')
+    date_text = dates.strftime('%Y-%m-%d %H:%M:%S').values
+
+    files = []
+    for i, station in enumerate(stations['station']):
+        file_path = os.path.join(input_dir, f"{station}_{years[0]}-{years[-1]}_10m.csv")
+        files.append(file_path)
+        if os.path.exists(file_path):
+            continue
+
+        rng = np.random.default_rng([seed, i])
+        rr = np.where(rng.random(len(dates)) < 0.03, np.round(rng.gamma(0.6, 2.0, len(dates)), 1), 0.0)
+        kept = rng.random(len(dates)) >= 0.02
+        pd.DataFrame({'date': date_text[kept], 'station': station, 'rr': rr[kept]}).to_csv(file_path, index=False)
+    return files
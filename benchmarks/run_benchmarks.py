@@ -0,0 +1,183 @@
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+
+import pandas as pd
+import xarray as xr
+
+import fixtures
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(repo_dir, 'environment_conditions'))
+sys.path.append(os.path.join(repo_dir, 'precipitation'))
+import era5_utils
+from era5_utils import (RunningStats, build_event_alignment, cache_month, composite_events, extract_events,
+                        load_stations, profile_levels, region_month_stats, run_all_days, stability_month,
+                        summarize_distribution, summary_bins)
+from precipitation_utils import (compute_thresholds, convert_10m, detect_extreme_events, get_output_file,
+                                 ingest_parquet, list_station_files, monthly_totals)
+
+# Scales as (stations, years); pick some with e.g. 'python run_benchmarks.py 20x1 200x1'
+scales = [(20, 1), (200, 1), (2000, 1), (20, 9), (200, 9), (2000, 9)]
+
+# Synthetic inputs are kept between runs in fixture_dir (job-local disk on Gadi); reports go to report_dir
+fixture_dir = os.path.join(os.environ.get('TMPDIR', '/tmp'), 'daes_benchmark')
+report_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+workers = int(os.environ.get('PBS_NCPUS', 1))
+first_year = 2015
+
+
+# Function to run one stage, print its wall time and add it to the stage list
+def timed(stages, name, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    stages.append({'stage': name, 'seconds': round(time.perf_counter() - start, 3)})
+    print(f"  {name}: {stages[-1]['seconds']:.2f} s")
+    return result
+
+
+# Function to compute the stability indices of every month at the stations, as kindex_all_days.py does
+def stability_all_days(stations, years):
+    months = [stability_month(stations, year, month) for year in years for month in range(1, 13)]
+    return xr.concat([indices for indices in months if indices is not None], dim='time')
+
+
+# Function to accumulate the u and v climatology of the box over every month, as wind_all_days.py does
+def wind_climatology(years):
+    totals = {var: RunningStats(dim='time') for var in ('u', 'v')}
+    for year in years:
+        for month in range(1, 13):
+            for var, stats in totals.items():
+                month_stats = region_month_stats(var, year, month, profile_levels)
+                if month_stats is not None:
+                    stats.merge(month_stats)
+    return totals
+
+
+# Function to copy some variables into the regional cache, as build_era5_cache.py does
+def build_cache(variables, years):
+    return sum(cache_month(var, year, month) for var in variables for year in years for month in range(1, 13))
+
+
+# Function to time every pipeline stage at one scale on the synthetic inputs
+def run_scale(n_stations, n_years):
+    years = range(first_year, first_year + n_years)
+    run_dir = os.path.join(fixture_dir, 'runs', f"{n_stations}x{n_years}")
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.makedirs(run_dir)
+
+    # Inputs, generated once and reused by later runs
+    start = time.perf_counter()
+    era5_dir = os.path.join(fixture_dir, 'era5')
+    fixtures.make_era5(era5_dir, years)
+    station_file = os.path.join(run_dir, 'stations_coordinate.csv')
+    stations = fixtures.make_stations(station_file, n_stations)
+    tenmin_dir = os.path.join(fixture_dir, '10m', f"{n_stations}x{n_years}")
+    fixtures.make_10m_files(tenmin_dir, stations, years)
+    fixture_seconds = round(time.perf_counter() - start, 3)
+
+    # Point the extraction engine at the synthetic replica, with no regional cache
+    era5_utils.era5_dir = era5_dir
+    era5_utils.cache_dir = os.path.join(run_dir, 'zarr')
+
+    print(f"{n_stations} stations x {n_years} year(s):")
+    stages = []
+    output_dir = os.path.join(run_dir, 'output')
+    os.makedirs(output_dir)
+
+    # ERA5 at the stations, all days
+    station_index = timed(stages, 'station_index', load_stations, station_file)
+    series = {var: os.path.join(output_dir, f"{var}_all_days.nc") for var in ('cape', 'cin', 'tcwv')}
+    timed(stages, 'all_days_series', run_all_days, series, station_index, years=years, workers=workers)
+    bilinear = {var: os.path.join(output_dir, 'bilinear', f"{var}_all_days.nc") for var in series}
+    os.makedirs(os.path.join(output_dir, 'bilinear'))
+    timed(stages, 'all_days_series_bilinear', run_all_days, bilinear, station_index, years=years, workers=workers,
+          method='bilinear')
+    profiles = {var: os.path.join(output_dir, f"{var}_all_days.nc") for var in ('t', 'r', 'u', 'v')}
+    timed(stages, 'all_days_profiles', run_all_days, profiles, station_index, years=years, workers=workers)
+    timed(stages, 'stability_indices', stability_all_days, station_index, years)
+    timed(stages, 'wind_climatology', wind_climatology, years)
+
+    # Station rainfall
+    csv_files = list_station_files(tenmin_dir)
+    timed(stages, 'convert_10m', convert_10m, tenmin_dir, output_dir, periods=('daily', 'hourly', '3hourly'), workers=workers)
+    daily_store = os.path.join(output_dir, 'parquet', 'daily')
+    timed(stages, 'ingest_parquet', ingest_parquet, get_output_file(output_dir, 'daily'), daily_store, workers=workers)
+    timed(stages, 'thresholds', compute_thresholds, csv_files, workers=workers)
+    events_file = os.path.join(output_dir, 'extreme_events.csv')
+    _, events = timed(stages, 'extreme_events', detect_extreme_events, csv_files, events_file,
+                      os.path.join(output_dir, 'thresholds.csv'), workers=workers)
+    timed(stages, 'monthly_totals', monthly_totals, daily_store)
+
+    # ERA5 at the extreme events
+    alignment = timed(stages, 'event_alignment', build_event_alignment, events, station_index,
+                      os.path.join(output_dir, 'event_alignment.csv'))
+    timed(stages, 'extract_events_cape', extract_events, 'cape', alignment)
+    timed(stages, 'extract_events_t', extract_events, 't', alignment, levels=profile_levels)
+    timed(stages, 'composite_events_t', composite_events, 't', alignment, levels=profile_levels)
+
+    # Distribution summaries of all_variables.ipynb
+    timed(stages, 'summary_cape', summarize_distribution, series['cape'], 'cape', summary_bins['cape'])
+
+    # Regional cache, built last so the stages above read the monthly files
+    timed(stages, 'cache_month', build_cache, ('cape', 't'), years)
+
+    return {
+        'stations': n_stations,
+        'years': n_years,
+        'events': len(events),
+        'fixture_seconds': fixture_seconds,
+        'total_seconds': round(sum(stage['seconds'] for stage in stages), 3),
+        'stages': stages,
+    }
+
+
+# Function to get the commit the benchmark ran on, if the tree is a git checkout
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_dir,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Function to tabulate the stage times of a report against an earlier one
+def compare_reports(previous, current):
+    def stage_times(report):
+        return pd.DataFrame([{'scale': f"{run['stations']}x{run['years']}", **stage}
+                             for run in report['runs'] for stage in run['stages']]).set_index(['scale', 'stage'])['seconds']
+
+    table = pd.concat({'previous': stage_times(previous), 'current': stage_times(current)}, axis=1).dropna()
+    table['ratio'] = (table['current'] / table['previous']).round(2)
+    return table
+
+
+if __name__ == '__main__':
+    selected = [tuple(int(n) for n in arg.split('x')) for arg in sys.argv[1:]] or scales
+    previous_reports = sorted(glob.glob(os.path.join(report_dir, 'benchmark_*.json')))
+
+    report = {
+        'created': pd.Timestamp.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'workers': workers,
+        'runs': [run_scale(n_stations, n_years) for n_stations, n_years in selected],
+    }
+
+    os.makedirs(report_dir, exist_ok=True)
+    report_file = os.path.join(report_dir, f"benchmark_{pd.Timestamp.now():%Y%m%d-%H%M%S}.json")
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"Benchmark report saved to {report_file}")
+
+    # Slower stages show up as ratios above 1
+    if previous_reports:
+        with open(previous_reports[-1]) as f:
+            print(f"Compared with {os.path.basename(previous_reports[-1])}:")
+            print(compare_reports(json.load(f), report).to_string())
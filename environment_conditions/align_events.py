@@ -0,0 +1,15 @@
+import pandas as pd
+
+from era5_utils import alignment_file, build_event_alignment, events_file, load_stations
+
+# Station names of the events that differ from the station list: {events name: station list name}
+station_aliases = {
+    'AAWS Balitbu Sumani': 'AAWS Balitbu Solok',
+    'AAWS GAW Bukit Kototabang': 'AAWS GAW Kototabang',
+    'AAWS Harau (AWS )': 'AWS Harau',
+}
+
+# Match every extreme event once to its ERA5 hour, monthly file and grid cell; the
+# *_extreme_days.py scripts read the table instead of resolving the events themselves
+events = pd.read_csv(events_file)
+build_event_alignment(events, load_stations(), alignment_file, aliases=station_aliases)
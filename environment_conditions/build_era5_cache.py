@@ -0,0 +1,14 @@
+import os
+
+from era5_utils import cache_month, get_cache_store, years
+
+# Variables to copy into the regional cache (see VARIABLES and cache_region in era5_utils.py)
+variables = ['cape', 'cin', 'tcwv', 't', 'r', 'u', 'v']
+
+os.makedirs(os.path.dirname(get_cache_store(variables[0])), exist_ok=True)
+for var in variables:
+    for year in years:
+        for month in range(1, 13):
+            if cache_month(var, year, month):
+                print(f"Cached {var} {year}-{month:02d}")
+print("Regional ERA5 cache is up to date.")
@@ -1,48 +1,29 @@
-import pandas as pd
 import xarray as xr
 import os
-import glob
+import sys
+
+# Shared ERA5 extraction helpers live one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from era5_utils import extract_events, load_event_alignment
 
 # File paths
-csv_path = '/scratch/k10/ef7927/research_project/csv/all_stations/extreme_events.csv'
-base_nc_path = '/g/data/rt52/era5/single-levels/reanalysis/cape/{}/{}'
+alignment_path = '/scratch/k10/ef7927/research_project/csv/all_stations/event_alignment.csv'
 output_dir = '/scratch/k10/ef7927/research_project/netcdf/stations/999/'
 os.makedirs(output_dir, exist_ok=True)
 
-# Read the CSV file
-df = pd.read_csv(csv_path)
-
-# Initialize a dictionary to store CAPE profiles by location
-cape_profiles = {}
-
-# Process each row
-for _, row in df.iterrows():
-    date = pd.to_datetime(row['date'])
-    lon, lat = row['longitude'], row['latitude']
-    year, month = date.year, date.month
-    days_in_month = pd.Period(f"{year}-{month:02d}").days_in_month
+# Extreme events matched to their ERA5 hour, monthly file and grid cell (see ../align_events.py)
+df = load_event_alignment(alignment_path)
 
-    nc_file = f"cape_era5_oper_sfc_{year}{month:02d}01-{year}{month:02d}{days_in_month:02d}.nc"
-    nc_file_path = base_nc_path.format(year, nc_file)
+# Extract CAPE at every event's nearest hour and grid point, one monthly file at a time
+cape_data = extract_events('cape', df)
+if cape_data is None:
+    raise SystemExit("No CAPE data found for the extreme events.")
 
-    if not os.path.exists(nc_file_path):
-        print(f"NetCDF file not found: {nc_file_path}")
-        continue
-
-    print(f"Processing: {nc_file} (Lat: {lat}, Lon: {lon})")
-    
-    # Open dataset and extract CAPE for the specific location and time
-    ds = xr.open_dataset(nc_file_path)
-    cape_data = ds['cape'].sel(time=date, longitude=lon, latitude=lat, method='nearest')
-    ds.close()
-
-    # Store CAPE data grouped by location
-    cape_profiles.setdefault((lon, lat), []).append(cape_data.drop_vars(['longitude', 'latitude']))
-
-# Save CAPE profiles
-for (lon, lat), cape_data_list in cape_profiles.items():
-    cape_array = xr.concat(cape_data_list, dim='time')
-    ds_out = xr.Dataset({'cape': (['time'], cape_array.data)}, coords={'time': cape_array.time, 'longitude': lon, 'latitude': lat})
+# Save CAPE profiles grouped by location, in the row order of the CSV
+events = df.iloc[cape_data['event'].values]
+for (lon, lat), location_events in events.groupby(['longitude', 'latitude'], sort=False):
+    cape_array = cape_data.sel(event=location_events.index.values)
+    ds_out = xr.Dataset({'cape': (['time'], cape_array.data)}, coords={'time': cape_array.time.values, 'longitude': lon, 'latitude': lat})
     
     nc_output_file = f"cape_profile_lon{lon}_lat{lat}.nc"
     ds_out.to_netcdf(os.path.join(output_dir, nc_output_file))
@@ -0,0 +1,27 @@
+import os
+
+from era5_utils import composite_events, load_event_alignment, profile_levels
+
+# File paths
+alignment_path = '/scratch/k10/ef7927/research_project/csv/all_stations/event_alignment.csv'
+output_dir = '/scratch/k10/ef7927/research_project/netcdf/composites/'
+
+# Variables to composite (see VARIABLES in era5_utils.py) and the lag window, in hours after the event hour
+variables = ['cape', 'cin', 'tcwv', 't', 'r', 'u', 'v']
+lags = range(-24, 7)
+
+# Extreme events matched to their ERA5 hour, monthly file and grid cell (see align_events.py)
+events = load_event_alignment(alignment_path)
+os.makedirs(output_dir, exist_ok=True)
+
+# Event-centred composites and anomalies of the West Sumatra box, reading each monthly file once per variable
+for var in variables:
+    levels = profile_levels if var in ('t', 'r', 'u', 'v') else None
+    composite = composite_events(var, events, lags, levels=levels)
+    if composite is None:
+        print(f"No {var} data found for the extreme events.")
+        continue
+
+    output_file = os.path.join(output_dir, f"{var}_lag_composite_extreme_days.nc")
+    composite.to_netcdf(output_file)
+    print(f"{var} composite of {int(composite['count'].max())} events saved to {output_file}")
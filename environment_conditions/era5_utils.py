@@ -0,0 +1,1109 @@
+import hashlib
+import json
+import os
+from calendar import monthrange
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from scipy import sparse
+
+from instrumentation import count_file, count_selection, stage
+from stability import stability_indices, stability_levels
+
+# Root of the ERA5 replica on Gadi, the default station list and the extreme events with their ERA5 alignment
+era5_dir = '/g/data/rt52/era5'
+station_file = '/scratch/k10/ef7927/research_project/csv/all_stations/stations_coordinate.csv'
+events_file = '/scratch/k10/ef7927/research_project/csv/all_stations/extreme_events.csv'
+alignment_file = '/scratch/k10/ef7927/research_project/csv/all_stations/event_alignment.csv'
+years = range(2015, 2024)
+
+# Pressure levels kept for the vertical profiles
+profile_levels = [100, 200, 300, 500, 700, 850, 925, 1000]
+
+# Quantiles reported for the vertical profiles, from their histograms
+profile_quantiles = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+# Variables known to the extractor. Adding a variable only needs an entry here:
+#   level_type - 'single-levels' or 'pressure-levels' (ERA5 directory)
+#   stream     - file name tag ('sfc' or 'pl')
+#   levels     - pressure levels to keep (None keeps all levels)
+#   output     - 'series' keeps the hourly (time, station) time series,
+#                'mean_profile' keeps the time-mean vertical profile per station
+#                (with its count, standard deviation and quantiles)
+#   bins       - histogram bin edges of a 'mean_profile' variable, for its quantiles
+VARIABLES = {
+    'cape': {'level_type': 'single-levels', 'stream': 'sfc', 'output': 'series'},
+    'cin': {'level_type': 'single-levels', 'stream': 'sfc', 'output': 'series'},
+    'tcwv': {'level_type': 'single-levels', 'stream': 'sfc', 'output': 'series'},
+    't': {'level_type': 'pressure-levels', 'stream': 'pl', 'levels': profile_levels, 'output': 'mean_profile',
+          'bins': np.linspace(150.0, 350.0, 801)},
+    'r': {'level_type': 'pressure-levels', 'stream': 'pl', 'levels': None, 'output': 'mean_profile',
+          'bins': np.linspace(0.0, 150.0, 301)},
+    'u': {'level_type': 'pressure-levels', 'stream': 'pl', 'levels': profile_levels, 'output': 'mean_profile',
+          'bins': np.linspace(-100.0, 100.0, 801)},
+    'v': {'level_type': 'pressure-levels', 'stream': 'pl', 'levels': profile_levels, 'output': 'mean_profile',
+          'bins': np.linspace(-100.0, 100.0, 801)},
+}
+
+# Histogram bin edges of the all-days vs extreme-days distributions in all_variables.ipynb,
+# fine enough to be merged into the plotted bins; values outside go to the end bins
+summary_bins = {
+    'cape': np.linspace(-100.0, 8000.0, 811),
+    'cin': np.linspace(0.0, 2000.0, 1001),
+    'K_index': np.linspace(-50.0, 60.0, 1101),
+    'tcwv': np.linspace(0.0, 100.0, 501),
+}
+summary_dir = '/scratch/k10/ef7927/research_project/netcdf/summaries'
+
+# Ways of taking a gridded field to the stations: the nearest cell, or a weighted sum of the four
+# cells around the station (bilinear, or inverse distance with weights 1/d**2)
+interpolation_methods = ['nearest', 'bilinear', 'idw']
+
+# Regional Zarr cache of the West Sumatra box (built by build_era5_cache.py), one store per variable
+cache_dir = '/scratch/k10/ef7927/research_project/zarr/era5_west_sumatra'
+cache_region = {'latitude': slice(5.0, -5.0), 'longitude': slice(95.0, 105.0)}
+
+
+# Function to construct the monthly ERA5 NetCDF file path of a variable
+def get_netcdf_file(var, year, month):
+    config = VARIABLES[var]
+    days = monthrange(year, month)[1]
+    file_name = f"{var}_era5_oper_{config['stream']}_{year}{month:02d}01-{year}{month:02d}{days:02d}.nc"
+    return os.path.join(era5_dir, config['level_type'], 'reanalysis', var, str(year), file_name)
+
+
+# Function to construct the path of a variable's store in the regional cache
+def get_cache_store(var):
+    return os.path.join(cache_dir, f"{var}.zarr")
+
+
+# Function to list the (year, month) pairs whose hours are all present in a cached store
+def cached_months(ds):
+    times = pd.DatetimeIndex(ds['time'].values)
+    counts = pd.Series(1, index=times).groupby([times.year, times.month]).size()
+    return {(year, month) for (year, month), n in counts.items() if n == monthrange(year, month)[1] * 24}
+
+
+# Function to check that a cached store holds the requested levels and points
+def cache_covers(ds, levels=None, latitudes=(), longitudes=()):
+    if 'level' in ds.dims:
+        if levels is None and not ds.attrs.get('all_levels', False):
+            return False
+        if levels is not None and not set(levels).issubset(ds['level'].values.tolist()):
+            return False
+
+    # Points must fall inside the box, allowing half a grid cell at the edges
+    half_cell = 0.125
+    lat, lon = ds['latitude'].values, ds['longitude'].values
+    inside_lat = np.all((np.asarray(latitudes) >= lat.min() - half_cell) & (np.asarray(latitudes) <= lat.max() + half_cell))
+    inside_lon = np.all((np.asarray(longitudes) >= lon.min() - half_cell) & (np.asarray(longitudes) <= lon.max() + half_cell))
+    return bool(inside_lat and inside_lon)
+
+
+# Function to open one month of a variable, from the regional cache when it covers the request
+def open_month(var, year, month, levels=None, latitudes=(), longitudes=()):
+    """Return the month as a Dataset (cache or ERA5 NetCDF file), or None when neither has it."""
+    store = get_cache_store(var)
+    if os.path.exists(store):
+        ds = xr.open_zarr(store)
+        if (year, month) in cached_months(ds) and cache_covers(ds, levels, latitudes, longitudes):
+            count_file(store)
+            return ds.sel(time=f"{year}-{month:02d}")
+        ds.close()
+
+    nc_file = get_netcdf_file(var, year, month)
+    if not os.path.exists(nc_file):
+        return None
+    count_file(nc_file)
+    return xr.open_dataset(nc_file)
+
+
+# Function to append one month of a variable's West Sumatra box to its regional cache store
+def cache_month(var, year, month):
+    """Return True when the month was added. Months are appended in time order, so the
+    cached time axis stays monotonic; a month before the last cached one is refused."""
+    store = get_cache_store(var)
+    if os.path.exists(store):
+        with xr.open_zarr(store) as cached:
+            if (year, month) in cached_months(cached):
+                return False
+            last = pd.Timestamp(cached['time'].values[-1])
+        if (year, month) <= (last.year, last.month):
+            print(f"Cannot add {var} {year}-{month:02d} after {last:%Y-%m}; rebuild {store} to change earlier months.")
+            return False
+
+    nc_file = get_netcdf_file(var, year, month)
+    if not os.path.exists(nc_file):
+        print(f"NetCDF file not found: {nc_file}")
+        return False
+
+    with stage('cache_month', var=var, year=year, month=month, file=nc_file), xr.open_dataset(nc_file) as ds:
+        count_file(nc_file)
+        subset = ds[[var]].sel(**cache_region)
+        levels = VARIABLES[var].get('levels')
+        if levels is not None and 'level' in subset.dims:
+            subset = subset.sel(level=levels)
+
+        # Global grid index of the box's first row and column, for the cached station indices
+        subset[var].attrs['lat_offset'] = ds.indexes['latitude'].get_loc(subset['latitude'].values[0])
+        subset[var].attrs['lon_offset'] = ds.indexes['longitude'].get_loc(subset['longitude'].values[0])
+        subset.attrs['all_levels'] = int(levels is None)
+
+        # ERA5 files are packed (int16 with their own scale_factor and add_offset) one month at a time, and an
+        # append is encoded with the store's first encoding; values are therefore cached unpacked, as float32
+        subset = subset.load()
+        for name in subset.variables:
+            subset[name].encoding = {}
+        subset[var] = subset[var].astype('float32')
+
+        # One day per chunk: every month is a whole number of chunks, so appends stay aligned
+        subset = subset.chunk({'time': 24})
+        if os.path.exists(store):
+            subset.to_zarr(store, append_dim='time')
+        else:
+            subset.to_zarr(store, mode='w', encoding={var: {'dtype': 'float32'}})
+    return True
+
+
+# Function to find the nearest point of a regular 1-D grid (e.g. ERA5 latitudes) for each value
+def nearest_grid_indices(grid, values):
+    grid = np.asarray(grid, dtype=float)
+    step = grid[1] - grid[0]
+    idx = np.rint((np.asarray(values, dtype=float) - grid[0]) / step).astype(int)
+    return np.clip(idx, 0, len(grid) - 1)
+
+
+# Function to find the grid points on either side of each value along a regular 1-D grid
+def bracketing_grid_indices(grid, values):
+    """Return (lower index, upper index, fraction of the way from lower to upper) per value."""
+    grid = np.asarray(grid, dtype=float)
+    position = (np.asarray(values, dtype=float) - grid[0]) / (grid[1] - grid[0])
+    lower = np.clip(np.floor(position).astype(int), 0, len(grid) - 2)
+    return lower, lower + 1, np.clip(position - lower, 0.0, 1.0)
+
+
+# Function to compute great-circle distances in km
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0 * np.arcsin(np.sqrt(a))
+
+
+# Columns of the station index used by the interpolation: the four cells around each station
+# (corner k is (lat_idx0 or lat_idx1, lon_idx0 or lon_idx1) in the order 00, 01, 10, 11)
+# and the weight of each corner per method
+corner_columns = ['lat_idx0', 'lat_idx1', 'lon_idx0', 'lon_idx1']
+weight_columns = [f"{method}_w{k}" for method in interpolation_methods[1:] for k in range(4)]
+
+
+# Function to compute the bilinear and inverse-distance weights of the four cells around each station
+def interpolation_weights(grid_lat, grid_lon, latitudes, longitudes, power=2):
+    """Return a DataFrame with the corner_columns and weight_columns of each point."""
+    lat0, lat1, fy = bracketing_grid_indices(grid_lat, latitudes)
+    lon0, lon1, fx = bracketing_grid_indices(grid_lon, longitudes)
+    weights = pd.DataFrame({'lat_idx0': lat0, 'lat_idx1': lat1, 'lon_idx0': lon0, 'lon_idx1': lon1})
+
+    corners = [(lat0, lon0), (lat0, lon1), (lat1, lon0), (lat1, lon1)]
+    bilinear = [(1 - fy) * (1 - fx), (1 - fy) * fx, fy * (1 - fx), fy * fx]
+    distances = np.array([haversine_km(latitudes, longitudes, grid_lat[i], grid_lon[j]) for i, j in corners])
+
+    # A station on a grid point takes that point's value
+    on_point = distances < 1e-6
+    inverse = np.where(on_point.any(axis=0), on_point.astype(float), 1 / np.maximum(distances, 1e-6) ** power)
+    inverse = inverse / inverse.sum(axis=0)
+
+    for k in range(4):
+        weights[f"bilinear_w{k}"] = bilinear[k]
+        weights[f"idw_w{k}"] = inverse[k]
+    return weights
+
+
+# Function to map every station to its ERA5 grid cell and save the mapping
+def build_station_index(stations, grid_file, index_file):
+    """Write the (lat_idx, lon_idx) of each station's nearest cell, its coordinates and distance,
+    and the four cells around it with their bilinear and inverse-distance weights."""
+    with xr.open_dataset(grid_file) as ds:
+        grid_lat = ds['latitude'].values
+        grid_lon = ds['longitude'].values
+
+    index = stations[['station', 'latitude', 'longitude']].copy()
+    index['lat_idx'] = nearest_grid_indices(grid_lat, index['latitude'])
+    index['lon_idx'] = nearest_grid_indices(grid_lon, index['longitude'])
+    index['grid_latitude'] = grid_lat[index['lat_idx']]
+    index['grid_longitude'] = grid_lon[index['lon_idx']]
+    index['distance_km'] = haversine_km(index['latitude'], index['longitude'], index['grid_latitude'], index['grid_longitude'])
+
+    # Corners and weights of the interpolation methods, computed once with the nearest cells
+    weights = interpolation_weights(grid_lat, grid_lon, index['latitude'].values, index['longitude'].values)
+    index[weights.columns] = weights.values
+    index = index.astype({column: int for column in corner_columns})
+
+    index.to_csv(index_file, index=False)
+    print(f"Station grid index saved to {index_file}")
+    return index
+
+
+# Function to read the cached station grid index, rebuilding it when the station list has changed
+def load_station_index(stations, index_file, grid_file=None):
+    if os.path.exists(index_file):
+        index = pd.read_csv(index_file)
+        cached = index[['station', 'latitude', 'longitude']].reset_index(drop=True)
+        current = stations[['station', 'latitude', 'longitude']].reset_index(drop=True)
+        # Indexes written before the interpolation weights were added are rebuilt too
+        if cached.equals(current) and set(corner_columns + weight_columns).issubset(index.columns):
+            return index
+
+    # Any ERA5 file works as the reference: all variables share the 0.25 degree grid
+    grid_file = grid_file or get_netcdf_file('cape', years[0], 1)
+    return build_station_index(stations, grid_file, index_file)
+
+
+# Function to load the station list with clean column names and its grid index
+def load_stations(path=station_file, index_file=None):
+    stations = pd.read_csv(path).rename(columns=str.strip)
+    if not {'latitude', 'longitude'}.issubset(stations.columns):
+        raise KeyError("Missing required columns: 'latitude' and/or 'longitude'.")
+    if 'station' not in stations:
+        stations['station'] = stations.index.astype(str)
+    stations = stations.reset_index(drop=True)
+
+    # The index sits next to the station list unless given
+    index_file = index_file or os.path.join(os.path.dirname(path), 'station_grid_index.csv')
+    index = load_station_index(stations, index_file)
+    columns = ['lat_idx', 'lon_idx'] + corner_columns + weight_columns
+    return stations.assign(**{column: index[column].values for column in columns})
+
+
+# Function to build the sparse (stations x cells) weight matrix of an interpolation over a grid slab
+def interpolation_matrix(stations, method, lat_start, lon_start, n_lat, n_lon):
+    """Rows are stations, columns the cells of the slab of `n_lat` x `n_lon` cells whose first
+    cell has the index (`lat_start`, `lon_start`) in the station index, flattened latitude-major."""
+    lat = stations[['lat_idx0', 'lat_idx0', 'lat_idx1', 'lat_idx1']].values - lat_start
+    lon = stations[['lon_idx0', 'lon_idx1', 'lon_idx0', 'lon_idx1']].values - lon_start
+    if lat.min() < 0 or lon.min() < 0 or lat.max() >= n_lat or lon.max() >= n_lon:
+        raise ValueError("Stations too close to the edge of the grid to interpolate; use a larger region.")
+
+    weights = stations[[f"{method}_w{k}" for k in range(4)]].values
+    rows = np.repeat(np.arange(len(stations)), 4)
+    return sparse.csr_matrix((weights.ravel(), (rows, (lat * n_lon + lon).ravel())),
+                             shape=(len(stations), n_lat * n_lon))
+
+
+# Function to interpolate a field to every station with one sparse matrix product per time chunk
+def interpolate_stations(da, stations, method='bilinear', chunk_size=168):
+    """Return `da` interpolated to the stations, with a 'station' dimension in place of
+    latitude and longitude.
+
+    Only the slab of cells around the stations is read, `chunk_size` time steps at a
+    time; every level and time step of a chunk is a column of the one matrix product.
+    """
+    # Slab around the stations, in the indices of `da` (shifted by the offsets of a regional cache)
+    lat_offset, lon_offset = da.attrs.get('lat_offset', 0), da.attrs.get('lon_offset', 0)
+    lat_start = int(stations[['lat_idx0', 'lat_idx1']].values.min()) - lat_offset
+    lat_stop = int(stations[['lat_idx0', 'lat_idx1']].values.max()) - lat_offset + 1
+    lon_start = int(stations[['lon_idx0', 'lon_idx1']].values.min()) - lon_offset
+    lon_stop = int(stations[['lon_idx0', 'lon_idx1']].values.max()) - lon_offset + 1
+    if lat_start < 0 or lon_start < 0:
+        raise ValueError("Stations too close to the edge of the grid to interpolate; use a larger region.")
+    slab = da.isel(latitude=slice(lat_start, lat_stop), longitude=slice(lon_start, lon_stop))
+    n_lat, n_lon = slab.sizes['latitude'], slab.sizes['longitude']
+    matrix = interpolation_matrix(stations, method, lat_start + lat_offset, lon_start + lon_offset, n_lat, n_lon)
+
+    # Cells as rows, every other dimension flattened into columns
+    other = [dim for dim in slab.dims if dim not in ('latitude', 'longitude')]
+    slab = slab.transpose('latitude', 'longitude', *other)
+    chunks = [slice(None)]
+    if 'time' in other:
+        chunks = [slice(start, start + chunk_size) for start in range(0, slab.sizes['time'], chunk_size)]
+
+    count_selection()
+    blocks = []
+    for chunk in chunks:
+        block = slab.isel(time=chunk) if 'time' in other else slab
+        values = block.values.astype('float64').reshape(n_lat * n_lon, -1)
+        result = (matrix @ values).reshape((len(stations),) + block.shape[2:])
+        blocks.append(np.moveaxis(result, 0, -1))
+    data = np.concatenate(blocks, axis=other.index('time')) if 'time' in other else blocks[0]
+
+    coords = {dim: slab[dim].values for dim in other if dim in slab.coords}
+    interpolated = xr.DataArray(data, dims=other + ['station'], coords=coords, attrs=da.attrs, name=da.name)
+    interpolated.attrs['interpolation'] = method
+    return interpolated.assign_coords(
+        station=stations['station'].values,
+        latitude=('station', stations['latitude'].values),
+        longitude=('station', stations['longitude'].values)
+    )
+
+
+# Function to select the grid cell of every station at once
+def select_stations(da, stations, method='nearest'):
+    """Return `da` at the stations' grid cells, with a 'station' dimension.
+
+    Uses the cached 'lat_idx'/'lon_idx' of `load_stations` for direct integer indexing
+    (shifted by the offsets of a regional cache). With `method` 'bilinear' or 'idw',
+    the field is interpolated from the four cells around each station instead
+    (see interpolate_stations).
+    """
+    if method not in interpolation_methods:
+        raise ValueError(f"Unknown interpolation method: {method!r}")
+    if method != 'nearest':
+        return interpolate_stations(da, stations, method)
+
+    if {'lat_idx', 'lon_idx'}.issubset(stations.columns):
+        lat_idx = stations['lat_idx'].values - da.attrs.get('lat_offset', 0)
+        lon_idx = stations['lon_idx'].values - da.attrs.get('lon_offset', 0)
+    else:
+        lat_idx = nearest_grid_indices(da['latitude'].values, stations['latitude'])
+        lon_idx = nearest_grid_indices(da['longitude'].values, stations['longitude'])
+
+    count_selection()
+    selected = da.isel(
+        latitude=xr.DataArray(lat_idx, dims='station'),
+        longitude=xr.DataArray(lon_idx, dims='station')
+    )
+
+    # Station name and coordinates label the 'station' dimension; the cell centre is kept as grid_*
+    selected = selected.rename({'latitude': 'grid_latitude', 'longitude': 'grid_longitude'})
+    return selected.assign_coords(
+        station=stations['station'].values,
+        latitude=('station', stations['latitude'].values),
+        longitude=('station', stations['longitude'].values)
+    )
+
+
+# Function to extract several variables for all stations from one month of ERA5
+def extract_month(variables, stations, year, month, method='nearest'):
+    """Open each variable's month once (cache or file) and return {var: DataArray(time, station[, level])}."""
+    extracted = {}
+    for var in variables:
+        levels = VARIABLES[var].get('levels')
+        ds = open_month(var, year, month, levels, stations['latitude'], stations['longitude'])
+        if ds is None:
+            print(f"NetCDF file not found: {get_netcdf_file(var, year, month)}")
+            continue
+
+        with ds:
+            if var not in ds:
+                print(f"'{var}' variable missing for {year}-{month:02d}. Skipping...")
+                continue
+
+            da = ds[var]
+            if levels is not None and 'level' in da.dims:
+                da = da.sel(level=levels)
+            extracted[var] = select_stations(da, stations, method).load()
+    return extracted
+
+
+# Function to compute stability indices (see stability.py) of one month at all stations
+def stability_month(stations, year, month, indices=None, method='nearest'):
+    """Return a (time, station) Dataset of the indices, or None when the t or r month is missing.
+
+    Each station's t and r profiles are selected once for the whole month and shared by every index.
+    """
+    temp_data = open_month('t', year, month, stability_levels, stations['latitude'], stations['longitude'])
+    rh_data = open_month('r', year, month, stability_levels, stations['latitude'], stations['longitude'])
+    if temp_data is None or rh_data is None:
+        for ds in (temp_data, rh_data):
+            if ds is not None:
+                ds.close()
+        return None
+
+    with temp_data, rh_data:
+        temp = select_stations(temp_data['t'].sel(level=stability_levels), stations, method).load()
+        rh = select_stations(rh_data['r'].sel(level=stability_levels), stations, method).load()
+    return stability_indices(temp, rh, indices).transpose('time', 'station')
+
+
+# Function to merge the monthly statistics of a profile variable, and those of an earlier output
+def merge_profile_parts(var, part_files, previous_file=None):
+    """Return the profile summary of all months in `part_files` (plus `previous_file`, if given)."""
+    stats, histogram = RunningStats(), RunningHistogram(VARIABLES[var]['bins'])
+    for part_file in part_files:
+        with xr.open_dataset(part_file) as part:
+            part = part.load()
+        stats.merge(RunningStats.from_dataset(part))
+        histogram.merge(RunningHistogram.from_dataset(part))
+
+    if previous_file is not None:
+        with xr.open_dataset(previous_file) as previous:
+            previous = previous.load()
+        m2 = (previous['std'] ** 2 * (previous['count'] - 1)).fillna(0)
+        stats.merge_totals(previous['count'], previous[var], m2)
+        histogram.merge(RunningHistogram.from_dataset(previous))
+    return profile_summary(var, stats, histogram)
+
+
+# Function to merge the monthly partial files of a variable into its output, in the layout of its output type
+def write_output(var, part_files, output_file, last_month, existing=False, method='nearest'):
+    """Merge `part_files` (in time order) into `output_file`, holding a chunk or a month at a time.
+
+    With `existing`, the parts are months after those already in `output_file` and are
+    added to it: series are appended along time, profile statistics are merged.
+    `method` is the station interpolation of the parts, recorded with the output.
+    """
+    opened = []
+    with stage('write_output', var=var, file=output_file):
+        # Partials (and a previous output) are the files this stage reads
+        for path in part_files + ([output_file] if existing else []):
+            count_file(path)
+
+        if VARIABLES[var]['output'] == 'mean_profile':
+            out = merge_profile_parts(var, part_files, output_file if existing else None)
+        else:
+            # Dense (time, station) series with the station name, latitude and longitude as coordinates
+            ds = xr.open_mfdataset(part_files, combine='nested', concat_dim='time',
+                                   data_vars='minimal', coords='minimal', compat='override')
+            opened.append(ds)
+            out = ds[var].transpose('time', 'station').to_dataset(name=var)
+            if existing:
+                opened.append(xr.open_dataset(output_file))
+                out = xr.concat([opened[-1], out], dim='time', data_vars='minimal', coords='minimal', compat='override')
+
+        # Last month covered, so an update knows where to carry on
+        out.attrs['last_month'] = f"{last_month[0]}-{last_month[1]:02d}"
+        out.attrs['interpolation'] = method
+        try:
+            out.to_netcdf(output_file + '.tmp')
+        finally:
+            for ds in opened:
+                ds.close()
+        os.replace(output_file + '.tmp', output_file)
+    print(f"{var} data saved to {output_file}.")
+
+
+# Function to find the last month already in an all-days output for these stations, or None
+def output_last_month(var, output_file, stations, method='nearest'):
+    if not os.path.exists(output_file):
+        return None
+    with xr.open_dataset(output_file) as ds:
+        if 'station' not in ds.coords or ds['station'].values.tolist() != stations['station'].tolist():
+            print(f"Station list differs from {output_file}; extracting all months.")
+            return None
+        if ds.attrs.get('interpolation', 'nearest') != method:
+            print(f"{output_file} was not extracted with {method} interpolation; extracting all months.")
+            return None
+        if 'last_month' not in ds.attrs or (VARIABLES[var]['output'] == 'mean_profile' and 'histogram' not in ds):
+            print(f"No record of the months in {output_file}; extracting all months.")
+            return None
+        year, month = ds.attrs['last_month'].split('-')
+    return int(year), int(month)
+
+
+# Function to extract one (variable, year, month) shard and keep it as a partial NetCDF file
+def extract_shard(var, year, month, stations, parts_dir, method='nearest'):
+    """Return the path of the shard's partial file, or None when there is no input for it."""
+    profile = VARIABLES[var]['output'] == 'mean_profile'
+    tag = ('' if method == 'nearest' else f"_{method}") + ('_stats' if profile else '')
+    part_file = os.path.join(parts_dir, var, f"{var}_{year}{month:02d}{tag}.nc")
+
+    with stage('extract_shard', var=var, year=year, month=month, file=get_netcdf_file(var, year, month)):
+        extracted = extract_month([var], stations, year, month, method)
+        if var not in extracted:
+            return None
+
+        # Profiles only keep the month's statistics, so partials stay at stations x levels
+        part = extracted[var]
+        if profile:
+            stats, histogram = RunningStats(), RunningHistogram(VARIABLES[var]['bins'])
+            stats.update(part)
+            histogram.update(part)
+            part = xr.merge([stats.to_dataset(), histogram.to_dataset()], compat='override', join='exact')
+
+        # Write under a temporary name so a killed job never leaves a truncated partial
+        os.makedirs(os.path.dirname(part_file), exist_ok=True)
+        part.to_netcdf(part_file + '.tmp')
+        os.replace(part_file + '.tmp', part_file)
+    return part_file
+
+
+# Function to describe what a shard's partial file depends on besides its ERA5 file
+def shard_params(var, stations, method):
+    """Return the variable, its levels, the interpolation method and a hash of the station list."""
+    columns = [c for c in ['station', 'latitude', 'longitude'] + corner_columns + weight_columns if c in stations]
+    station_hash = hashlib.sha256(stations[columns].to_csv(index=False).encode()).hexdigest()
+    return {'variable': var, 'levels': VARIABLES[var].get('levels'), 'method': method, 'stations': station_hash}
+
+
+# Function to run the shards of an extraction, in a process pool when workers > 1
+def run_shards(outputs, stations, years, workers, parts_dir, after=None, method='nearest'):
+    """Return ({var: [(year, month, part_file)]}, [failed shards]).
+
+    `after` ({var: (year, month)}) limits a variable to the later months whose ERA5 file exists.
+    A partial file in `parts_dir` is reused only while its manifest entry matches the
+    shard's ERA5 file, station list, levels and interpolation method.
+    """
+    # Month-major order: a serial run reads every variable of a month before moving on
+    shards = [(var, year, month) for year in years for month in range(1, 13) for var in outputs]
+    if after:
+        shards = [(var, year, month) for var, year, month in shards
+                  if var not in after or ((year, month) > after[var] and os.path.exists(get_netcdf_file(var, year, month)))]
+    parts = {var: [] for var in outputs}
+    failed = []
+
+    # Only this process writes the manifest; workers just extract
+    manifest = Manifest(os.path.join(parts_dir, 'manifest.json'))
+    params = {var: shard_params(var, stations, method) for var in outputs}
+
+    def shard_key(shard):
+        return f"{shard[0]}_{shard[1]}{shard[2]:02d}"
+
+    def shard_inputs(shard):
+        return [f for f in [get_netcdf_file(*shard)] if os.path.exists(f)]
+
+    def collect(shard, part_file):
+        if part_file is not None:
+            manifest.record(shard_key(shard), shard_inputs(shard), part_file, params[shard[0]])
+            parts[shard[0]].append((shard[1], shard[2], part_file))
+
+    # Shards completed by an earlier run with the same inputs are not extracted again
+    pending = []
+    for shard in shards:
+        if manifest.done(shard_key(shard), shard_inputs(shard), params[shard[0]]):
+            parts[shard[0]].append((shard[1], shard[2], manifest.entries[shard_key(shard)]['output']))
+        else:
+            pending.append(shard)
+    shards = pending
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(extract_shard, *shard, stations, parts_dir, method): shard for shard in shards}
+            for future in as_completed(futures):
+                try:
+                    collect(futures[future], future.result())
+                except Exception as e:
+                    print(f"Shard {futures[future]} failed: {e}")
+                    failed.append(futures[future])
+    else:
+        for shard in shards:
+            try:
+                collect(shard, extract_shard(*shard, stations, parts_dir, method))
+            except Exception as e:
+                print(f"Shard {shard} failed: {e}")
+                failed.append(shard)
+    return parts, failed
+
+
+# Function to run the all-days extraction of several variables in one pass per month
+def run_all_days(outputs, stations, years=years, workers=1, parts_dir=None, update=False, method='nearest'):
+    """Extract every variable in `outputs` ({var: output_file}) and write one file per variable.
+
+    Each (variable, year, month) shard is streamed to `parts_dir` (default: 'parts' next to
+    the first output) as soon as it is extracted, in a process pool when `workers` > 1, so
+    peak memory stays at one month. The partial files are then merged in time order; shards
+    already on disk from the same ERA5 file, stations, levels and method (see the manifest in
+    `parts_dir`) are not extracted again, so a failed run only redoes the missing ones.
+
+    With `update`, only the months after the last one already in each output are extracted
+    (up to the newest ERA5 file, from the first year through the current one) and added to it.
+
+    `method` takes the fields to the stations: 'nearest' cell, or 'bilinear' / 'idw'
+    interpolation from the four cells around each station (see interpolate_stations).
+    """
+    unknown = set(outputs) - set(VARIABLES)
+    if unknown:
+        raise KeyError(f"Unknown ERA5 variables: {sorted(unknown)}")
+    if method not in interpolation_methods:
+        raise ValueError(f"Unknown interpolation method: {method!r}")
+
+    after = None
+    if update:
+        after = {var: output_last_month(var, output_file, stations, method) for var, output_file in outputs.items()}
+        after = {var: last for var, last in after.items() if last is not None}
+        years = range(years.start, pd.Timestamp.now().year + 1)
+
+    parts_dir = parts_dir or os.path.join(os.path.dirname(os.path.abspath(next(iter(outputs.values())))), 'parts')
+    parts, failed = run_shards(outputs, stations, years, workers, parts_dir, after, method)
+    if failed:
+        print(f"{len(failed)} shard(s) failed; rerun to extract only the missing ones. Nothing merged.")
+        return
+
+    # Merge in time order, whatever order the shards finished in
+    for var, output_file in outputs.items():
+        if parts[var]:
+            shards = sorted(parts[var])
+            write_output(var, [part_file for _, _, part_file in shards], output_file,
+                         shards[-1][:2], existing=bool(after) and var in after, method=method)
+        elif after and var in after:
+            print(f"{output_file} is up to date.")
+        else:
+            print(f"No {var} data found for any year.")
+
+
+# Function to compare station names that differ only in case, spacing or underscores
+def normalize_station_name(name):
+    return ' '.join(str(name).replace('_', ' ').split()).casefold()
+
+
+# Function to find the ERA5 hour nearest to each time, ties (hh:30) going to the later hour
+def nearest_era5_hour(dates):
+    # Same as get_indexer(..., method='nearest') on the hourly axis; dt.round('h') would round ties to the even hour
+    return (pd.to_datetime(dates) + pd.Timedelta('30min')).dt.floor('h')
+
+
+# Function to align every event with its ERA5 hour, monthly file and grid cell
+def build_event_alignment(events, stations, output_file=None, aliases=None, grid_file=None):
+    """Return (and save to `output_file`) one row per event with the columns
+    event, station, date, era5_time, file_key, hour_index, latitude, longitude, lat_idx, lon_idx.
+
+    `event` is the row position in `events`. Events without coordinates take those of
+    their station in `stations` (see load_stations), matched by name; `aliases` maps
+    event station names to station list names. Unmatched events are reported and left out.
+    """
+    events = events.reset_index(drop=True)
+    table = pd.DataFrame({'event': events.index, 'date': pd.to_datetime(events['date'])})
+    table['station'] = events['station'].values if 'station' in events else ''
+
+    if {'latitude', 'longitude'}.issubset(events.columns):
+        # Coordinates given with the events: same grid mapping as the station index
+        table['latitude'], table['longitude'] = events['latitude'].values, events['longitude'].values
+        with xr.open_dataset(grid_file or get_netcdf_file('cape', years[0], 1)) as grid:
+            table['lat_idx'] = nearest_grid_indices(grid['latitude'].values, table['latitude'])
+            table['lon_idx'] = nearest_grid_indices(grid['longitude'].values, table['longitude'])
+    else:
+        names = table['station'].replace(aliases or {}).map(normalize_station_name)
+        lookup = (stations.assign(key=stations['station'].map(normalize_station_name))
+                  .drop_duplicates('key').set_index('key')[['latitude', 'longitude', 'lat_idx', 'lon_idx']])
+        matched = lookup.reindex(names.values)
+        unmatched = matched['lat_idx'].isna().values
+        if unmatched.any():
+            print(f"{unmatched.sum()} event(s) of stations not in the station list left out: "
+                  f"{sorted(table.loc[unmatched, 'station'].unique())}")
+        table[matched.columns] = matched.values
+        table = table[~unmatched].astype({'lat_idx': int, 'lon_idx': int})
+
+    # Nearest ERA5 hour, which may fall in the next month's file
+    era5_time = nearest_era5_hour(table['date'])
+    table['era5_time'] = era5_time
+    table['file_key'] = era5_time.dt.strftime('%Y%m')
+    table['hour_index'] = (era5_time.dt.day - 1) * 24 + era5_time.dt.hour
+
+    table = table[['event', 'station', 'date', 'era5_time', 'file_key', 'hour_index',
+                   'latitude', 'longitude', 'lat_idx', 'lon_idx']].reset_index(drop=True)
+    if output_file:
+        table.to_csv(output_file, index=False)
+        print(f"Alignment of {len(table)} events saved to {output_file}")
+    return table
+
+
+# Function to load the event alignment table written by align_events.py
+def load_event_alignment(path=alignment_file):
+    return pd.read_csv(path, parse_dates=['date', 'era5_time'], dtype={'file_key': str})
+
+
+# Function to select the nearest hour and grid point of many events at once
+def select_events(da, events):
+    """Return `da` at each event's nearest time and grid point, with an 'event' dimension."""
+    if 'hour_index' in events.columns:
+        # Aligned events: hour within the monthly file
+        time_idx = events['hour_index'].values
+    else:
+        time_idx = da.indexes['time'].get_indexer(pd.to_datetime(events['date']), method='nearest')
+    if {'lat_idx', 'lon_idx'}.issubset(events.columns):
+        lat_idx = events['lat_idx'].values - da.attrs.get('lat_offset', 0)
+        lon_idx = events['lon_idx'].values - da.attrs.get('lon_offset', 0)
+    else:
+        # Same grid mapping as the station index
+        lat_idx = nearest_grid_indices(da['latitude'].values, events['latitude'])
+        lon_idx = nearest_grid_indices(da['longitude'].values, events['longitude'])
+    count_selection()
+    return da.isel(
+        time=xr.DataArray(time_idx, dims='event'),
+        latitude=xr.DataArray(lat_idx, dims='event'),
+        longitude=xr.DataArray(lon_idx, dims='event')
+    )
+
+
+# Function to extract a variable for every extreme event, opening each monthly file once
+def extract_events(var, events, levels=None):
+    """Return DataArray(event[, level]) for the rows of `events` ('date', 'latitude', 'longitude'),
+    preferably the event alignment table (see build_event_alignment).
+
+    The 'event' coordinate holds each row's position in `events`; rows whose month is
+    neither cached nor on disk are left out. The result keeps the row order of `events`.
+    """
+    positioned = events.reset_index(drop=True)
+    if 'file_key' in positioned.columns:
+        months = [positioned['file_key'].str[:4].astype(int).values, positioned['file_key'].str[4:].astype(int).values]
+    else:
+        dates = pd.to_datetime(positioned['date'])
+        positioned = positioned.assign(date=dates.values)
+        months = [dates.dt.year.values, dates.dt.month.values]
+
+    selected = []
+    for (year, month), month_events in positioned.groupby(months):
+        nc_file = get_netcdf_file(var, year, month)
+        with stage('extract_events', var=var, year=year, month=month, file=nc_file, events=len(month_events)):
+            ds = open_month(var, year, month, levels, month_events['latitude'], month_events['longitude'])
+            if ds is None:
+                print(f"NetCDF file not found: {nc_file}")
+                continue
+
+            with ds:
+                if var not in ds:
+                    print(f"'{var}' variable missing for {year}-{month:02d}. Skipping...")
+                    continue
+
+                da = ds[var] if levels is None else ds[var].sel(level=levels)
+                selected.append(select_events(da, month_events).assign_coords(event=month_events.index.values).load())
+
+    if not selected:
+        return None
+    return xr.concat(selected, dim='event').sortby('event')
+
+
+# Function to build lead/lag composites of a regional field around the extreme events
+def composite_events(var, events, lags=range(-24, 7), levels=None, region=cache_region, anomalies=True):
+    """Return a Dataset with the event-mean field `var` (lag[, level], latitude, longitude) at each
+    lag (hours after the event hour), its anomaly and the number of events per lag.
+
+    `events` is the event alignment table (see build_event_alignment) or any table with a
+    'date' column. The (event, lag) hours are grouped by the monthly file they fall in, so
+    each file is read once however many events and lags (across month boundaries) need it,
+    and each distinct hour is weighted by the number of (event, lag) pairs at it.
+
+    With `anomalies`, each month is read whole and the anomaly is taken from the mean of
+    that month at the same hour of day, so the diurnal cycle does not show up as a signal.
+    """
+    lags = np.asarray(list(lags), dtype=int)
+    if 'era5_time' in events.columns:
+        event_times = pd.to_datetime(events['era5_time']).values
+    else:
+        event_times = nearest_era5_hour(events['date']).values
+
+    # One row per (event, lag): the lag's position and the ERA5 hour it needs
+    pairs = pd.DataFrame({
+        'lag': np.tile(np.arange(len(lags)), len(event_times)),
+        'time': pd.DatetimeIndex(np.repeat(event_times, len(lags)) + np.tile(lags, len(event_times)) * np.timedelta64(1, 'h')),
+    })
+    latitudes = [region['latitude'].start, region['latitude'].stop]
+    longitudes = [region['longitude'].start, region['longitude'].stop]
+
+    field_sum, anomaly_sum, counts = 0, 0, np.zeros(len(lags), dtype=int)
+    for (year, month), month_pairs in pairs.groupby([pairs['time'].dt.year, pairs['time'].dt.month]):
+        nc_file = get_netcdf_file(var, year, month)
+        with stage('composite_month', var=var, year=year, month=month, file=nc_file, pairs=len(month_pairs)):
+            ds = open_month(var, year, month, levels, latitudes, longitudes)
+            if ds is None:
+                print(f"NetCDF file not found: {nc_file}")
+                continue
+
+            with ds:
+                da = ds[var].sel(**region)
+                if levels is not None:
+                    da = da.sel(level=levels)
+
+                # (lag, hour) weights over the distinct hours of the month that any pair needs
+                hour_index = ((month_pairs['time'].dt.day - 1) * 24 + month_pairs['time'].dt.hour).values
+                hours, position = np.unique(hour_index, return_inverse=True)
+                weights = np.zeros((len(lags), len(hours)))
+                np.add.at(weights, (month_pairs['lag'].values, position), 1)
+
+                count_selection()
+                if anomalies:
+                    # Whole month in one read: the needed hours and the mean of each hour of day
+                    block = da.astype('float64').load()
+                    fields = block.isel(time=hours)
+                    climatology = block.groupby('time.hour').mean('time').reindex(hour=np.arange(24))
+                    hour_weights = np.zeros((len(lags), 24))
+                    np.add.at(hour_weights, (month_pairs['lag'].values, month_pairs['time'].dt.hour.values), 1)
+                    anomaly_sum = anomaly_sum + np.tensordot(hour_weights, climatology.transpose('hour', ...).values, axes=1)
+                else:
+                    fields = da.isel(time=hours).astype('float64').load()
+
+                fields = fields.transpose('time', ...)
+                field_sum = field_sum + np.tensordot(weights, fields.values, axes=1)
+                counts += weights.sum(axis=1).astype(int)
+                template = fields.isel(time=0, drop=True)
+
+    if not counts.any():
+        return None
+
+    # Lags with no events stay NaN
+    dims = ('lag',) + template.dims
+    coords = {**template.coords, 'lag': lags}
+    n = np.where(counts > 0, counts, np.nan).reshape((-1,) + (1,) * len(template.dims))
+    composite = xr.Dataset({
+        var: xr.DataArray(field_sum / n, dims=dims, coords=coords),
+        'count': xr.DataArray(counts, dims='lag', coords={'lag': lags}),
+    })
+    if anomalies:
+        composite[f"{var}_anomaly"] = xr.DataArray((field_sum - anomaly_sum) / n, dims=dims, coords=coords)
+    composite['lag'].attrs['units'] = 'hours after the event hour'
+    return composite
+
+
+class RunningStats:
+    """Streaming count, mean and variance of blocks of data along one dimension.
+
+    Each block is reduced on its own and merged into the running totals with the
+    parallel form of Welford's algorithm, so memory stays at the size of the result.
+    NaNs are skipped.
+    """
+
+    def __init__(self, dim='time'):
+        self.dim = dim
+        self.count = None
+        self.mean = None
+        self.m2 = None
+
+    def update(self, block):
+        block = block.astype('float64')
+        mean_b = block.mean(self.dim)
+        self.merge_totals(block.count(self.dim), mean_b, ((block - mean_b) ** 2).sum(self.dim))
+
+    def merge(self, other):
+        """Fold in another accumulator, e.g. the statistics of one month read back from disk."""
+        if other.count is not None:
+            self.merge_totals(other.count, other.mean, other.m2)
+
+    def merge_totals(self, n_b, mean_b, m2_b):
+        if self.count is None:
+            self.count, self.mean, self.m2 = n_b, mean_b, m2_b
+            return
+
+        n = self.count + n_b
+        delta = (mean_b - self.mean).fillna(0)
+        weighted = (self.count * self.mean.fillna(0) + n_b * mean_b.fillna(0)) / n.where(n > 0)
+        self.m2 = self.m2 + m2_b + delta ** 2 * (self.count * n_b / n.where(n > 0)).fillna(0)
+        self.mean = weighted
+        self.count = n
+
+    def to_dataset(self):
+        return xr.Dataset({'count': self.count, 'mean': self.mean, 'm2': self.m2})
+
+    @classmethod
+    def from_dataset(cls, ds, dim='time'):
+        stats = cls(dim)
+        stats.count, stats.mean, stats.m2 = ds['count'], ds['mean'], ds['m2']
+        return stats
+
+    def variance(self, ddof=1):
+        return self.m2 / (self.count - ddof).where(self.count > ddof)
+
+    def std(self, ddof=1):
+        return self.variance(ddof) ** 0.5
+
+
+class RunningHistogram:
+    """Streaming fixed-bin histogram of blocks of data along one dimension, for quantiles.
+
+    Counts are kept per point (e.g. station and level) and add up across blocks, so
+    quantiles of any number of months come from memory the size of points x bins.
+    Values outside the edges go to the first or last bin; NaNs are skipped.
+    """
+
+    def __init__(self, edges, dim='time'):
+        self.edges = np.asarray(edges, dtype=float)
+        self.dim = dim
+        self.counts = None
+
+    def update(self, block):
+        block = block.transpose(self.dim, ...)
+        values = block.values.reshape(block.shape[0], -1)
+        n_bins = len(self.edges) - 1
+
+        # One bincount over (point, bin) pairs for the whole block
+        bins = np.clip(np.searchsorted(self.edges, values, side='right') - 1, 0, n_bins - 1)
+        flat = (np.arange(values.shape[1]) * n_bins + bins)[~np.isnan(values)]
+        counts = np.bincount(flat, minlength=values.shape[1] * n_bins).astype('int32')
+
+        template = block.isel({self.dim: 0}, drop=True)
+        self.merge_counts(xr.DataArray(counts.reshape(template.shape + (n_bins,)),
+                                       dims=template.dims + ('bin',),
+                                       coords={**template.coords, 'bin': self.edges[:-1]}))
+
+    def merge(self, other):
+        if other.counts is not None:
+            self.merge_counts(other.counts)
+
+    def merge_counts(self, counts):
+        self.counts = counts if self.counts is None else self.counts + counts
+
+    def to_dataset(self):
+        return xr.Dataset({'histogram': self.counts})
+
+    @classmethod
+    def from_dataset(cls, ds, dim='time'):
+        histogram = cls(np.append(ds['bin'].values, 2 * ds['bin'].values[-1] - ds['bin'].values[-2]), dim)
+        histogram.counts = ds['histogram']
+        return histogram
+
+    def quantile(self, q):
+        """Quantiles (0-1) per point, linearly interpolated within the bin that holds them."""
+        counts = self.counts.transpose(..., 'bin')
+        hist = counts.values.astype(float)
+        cumulative = np.cumsum(hist, axis=-1)
+        total = cumulative[..., -1:]
+
+        result = []
+        for fraction in np.atleast_1d(q):
+            target = fraction * total
+            k = np.minimum((cumulative < target).sum(axis=-1, keepdims=True), hist.shape[-1] - 1)
+            in_bin = np.take_along_axis(hist, k, axis=-1)
+            below = np.take_along_axis(cumulative, k, axis=-1) - in_bin
+            position = np.where(in_bin > 0, (target - below) / np.where(in_bin > 0, in_bin, 1), 0.0)
+            value = self.edges[k] + position * (self.edges[k + 1] - self.edges[k])
+            result.append(np.where(total > 0, value, np.nan)[..., 0])
+
+        template = counts.isel(bin=0, drop=True)
+        return xr.DataArray(np.stack(result), dims=('quantile',) + template.dims,
+                            coords={**template.coords, 'quantile': np.atleast_1d(q)})
+
+
+# Function to accumulate one month of a variable over a region into running statistics per grid cell
+def region_month_stats(var, year, month, levels=None, region=cache_region):
+    """Return the month's RunningStats over time (per level and grid cell), or None when the month is missing."""
+    latitudes = [region['latitude'].start, region['latitude'].stop]
+    longitudes = [region['longitude'].start, region['longitude'].stop]
+    ds = open_month(var, year, month, levels, latitudes, longitudes)
+    if ds is None:
+        return None
+
+    stats = RunningStats(dim='time')
+    with ds:
+        da = ds[var].sel(**region)
+        if levels is not None:
+            da = da.sel(level=levels)
+        stats.update(da.load())
+    return stats
+
+
+# Function to summarise accumulated profile statistics in the 'mean_profile' output layout
+def profile_summary(var, stats, histogram):
+    return xr.Dataset({
+        var: stats.mean,
+        'count': stats.count,
+        'std': stats.std(),
+        'percentiles': histogram.quantile(profile_quantiles),
+        'histogram': histogram.counts,
+    })
+
+
+# Function to read the values of one variable from a NetCDF file `chunk_size` time steps at a time (or a CSV file in row chunks)
+def iter_value_chunks(path, var, chunk_size=744):
+    if path.endswith('.csv'):
+        for chunk in pd.read_csv(path, usecols=[var], chunksize=100000):
+            yield chunk[var].to_numpy(dtype='float64')
+        return
+
+    with xr.open_dataset(path) as ds:
+        da = ds[var]
+        dim = 'time' if 'time' in da.dims else da.dims[0]
+        for start in range(0, da.sizes[dim], chunk_size):
+            yield da.isel({dim: slice(start, start + chunk_size)}).values.astype('float64').ravel()
+
+
+# Function to summarise the distribution of every value of a variable in a file, one chunk at a time
+def summarize_distribution(path, var, edges, chunk_size=744):
+    """Return the count, mean, std, quantiles and histogram of all non-NaN values of `var`
+    in `path` (a NetCDF file or a CSV with a `var` column), pooled over stations, levels
+    and time. Only one chunk is held in memory; the result is in the profile_summary layout.
+    """
+    stats = RunningStats(dim='value')
+    histogram = RunningHistogram(edges, dim='value')
+    for values in iter_value_chunks(path, var, chunk_size):
+        values = xr.DataArray(values[~np.isnan(values)], dims='value')
+        if values.size:
+            stats.update(values)
+            histogram.update(values)
+
+    if stats.count is None:
+        raise ValueError(f"No {var} values in {path}")
+    return profile_summary(var, stats, histogram)
+
+
+# Function to get the cached distribution summary of a file, rebuilding it when the file or the bins changed
+def load_summary(path, var, population, edges=None, summary_dir=summary_dir):
+    """`population` names the sample ('all_days' or 'extreme_days') in the cache file name."""
+    edges = summary_bins[var] if edges is None else np.asarray(edges, dtype=float)
+    summary_file = os.path.join(summary_dir, f"{var}_{population}_summary.nc")
+    source = file_signature(path)
+
+    if os.path.exists(summary_file):
+        with xr.open_dataset(summary_file) as cached:
+            if (cached.attrs.get('source_size') == source['size']
+                    and cached.attrs.get('source_mtime') == source['mtime']
+                    and np.array_equal(cached['bin'].values, edges[:-1])):
+                return cached.load()
+
+    print(f"Summarising {var} ({population}) from {path}")
+    summary = summarize_distribution(path, var, edges)
+    summary.attrs.update(source=os.path.abspath(path), source_size=source['size'], source_mtime=source['mtime'])
+
+    os.makedirs(summary_dir, exist_ok=True)
+    summary.to_netcdf(summary_file + '.tmp')
+    os.replace(summary_file + '.tmp', summary_file)
+    return summary
+
+
+# Function to turn a summary's histogram into probability densities, merging every `factor` adjacent bins
+def summary_density(summary, factor=1):
+    """Return (density, edges) for matplotlib's stairs, trimmed to the bins that hold values."""
+    edges = RunningHistogram.from_dataset(summary).edges
+    n_bins = (len(edges) - 1) // factor * factor
+    counts = summary['histogram'].values[:n_bins].reshape(-1, factor).sum(axis=1)
+    edges = edges[:n_bins + 1:factor]
+
+    filled = np.flatnonzero(counts)
+    first, last = filled[0], filled[-1] + 1
+    density = counts[first:last] / counts.sum() / np.diff(edges[first:last + 1])
+    return density, edges[first:last + 1]
+
+
+# Function to checksum a file without reading it into memory at once
+def file_checksum(path, block_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(block_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+# Function to identify an input file by its size and modification time (cheap for large ERA5 files)
+def file_signature(path):
+    stat = os.stat(path)
+    return {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+class Manifest:
+    """JSON record of the completed shards of a long-running job, for checkpoint and resume.
+
+    Each entry keeps the shard's input files, the settings it was run with and its partial
+    output with a SHA-256 checksum. A shard counts as done only while its inputs and
+    settings are unchanged and its partial output still matches the checksum, so a
+    restarted job redoes nothing else.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def done(self, key, input_files, params=None):
+        """`params` (JSON-serialisable) are any other settings the output depends on."""
+        entry = self.entries.get(key)
+        if entry is None or not os.path.exists(entry['output']):
+            return False
+        if [file_signature(path) for path in input_files] != entry['inputs']:
+            return False
+        if entry.get('params') != params:
+            return False
+        return file_checksum(entry['output']) == entry['checksum']
+
+    def record(self, key, input_files, output_file, params=None):
+        self.entries[key] = {
+            'inputs': [file_signature(path) for path in input_files],
+            'output': output_file,
+            'checksum': file_checksum(output_file),
+            'params': params,
+        }
+
+        # Replace the manifest in one step so a killed job never leaves it half written
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(self.path + '.tmp', self.path)
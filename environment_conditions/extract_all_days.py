@@ -0,0 +1,32 @@
+import os
+import sys
+
+from era5_utils import load_stations, run_all_days
+
+# File paths
+location_path = '/scratch/k10/ef7927/research_project/csv/all_stations/stations_coordinate.csv'
+output_dir = '/scratch/k10/ef7927/research_project/netcdf/'
+
+# Variables to extract in one pass over the ERA5 monthly files (see VARIABLES in era5_utils.py)
+variables = ['cape', 'cin', 'tcwv', 't', 'r']
+
+# Worker processes, one (variable, year, month) shard each; defaults to the cores of the PBS job.
+# Partial files are kept in parts_dir so a rerun only extracts the shards that are missing.
+workers = int(os.environ.get('PBS_NCPUS', 1))
+parts_dir = os.path.join(output_dir, 'parts')
+
+# How fields are taken to the stations: 'nearest' cell, or 'bilinear' / 'idw' from the four cells
+# around each station (better for stations such as Alahan Panjang, between cells of different terrain)
+interpolation = 'nearest'
+
+# 'python extract_all_days.py update' only adds the months after those already in each output
+update = 'update' in sys.argv[1:]
+
+# With DAES_METRICS=<file.jsonl> set, every shard's wall time, bytes read, files, selections and
+# peak memory are written to that file (workers included) and summarised per stage at the end
+
+outputs = {var: os.path.join(output_dir, f"{var}_all_days.nc") for var in variables}
+os.makedirs(output_dir, exist_ok=True)
+
+run_all_days(outputs, load_stations(location_path), workers=workers, parts_dir=parts_dir, update=update,
+             method=interpolation)
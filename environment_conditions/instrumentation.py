@@ -0,0 +1,190 @@
+import atexit
+import functools
+import json
+import os
+import resource
+import sys
+import time
+
+import pandas as pd
+
+# Per-stage metrics go as JSON lines to the file named by DAES_METRICS; unset, every stage is a no-op.
+# Worker processes inherit the variables, so their stages land in the same file under the same run id.
+metrics_file = os.environ.get('DAES_METRICS')
+run_id = os.environ.get('DAES_METRICS_RUN')
+
+# Stages currently open in this process, outermost first; counters add to all of them
+_active = []
+
+
+# Function to read the bytes this process has read through system calls so far (Linux only)
+def bytes_read_so_far():
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+# Function to get the peak resident memory of this process so far in MB: a high-water mark, never lowered
+def process_peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kB elsewhere
+    return round(peak / (1024 ** 2 if sys.platform == 'darwin' else 1024), 1)
+
+
+class Stage:
+    """Wall time, bytes read, files opened, selections and memory of one block of work.
+
+    Use through stage(); `fields` (e.g. var, year, month, file) are written with the
+    metrics so records can be grouped per stage and per input file. Memory is the
+    process high-water mark at exit (`process_peak_rss_mb`, which includes everything
+    the process held before the stage) and how far the stage raised it
+    (`rss_growth_mb`, zero when the stage stayed under an earlier peak).
+    """
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.files = 0
+        self.selections = 0
+        self.record = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.start_bytes = bytes_read_so_far()
+        self.start_peak = process_peak_rss_mb()
+        _active.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _active.remove(self)
+        end_bytes = bytes_read_so_far()
+        end_peak = process_peak_rss_mb()
+        self.record = {
+            'run': run_id,
+            'stage': self.name,
+            **self.fields,
+            'pid': os.getpid(),
+            'wall_s': round(time.perf_counter() - self.start, 4),
+            'bytes_read': end_bytes - self.start_bytes if end_bytes is not None else None,
+            'files': self.files,
+            'selections': self.selections,
+            'process_peak_rss_mb': end_peak,
+            'rss_growth_mb': round(end_peak - self.start_peak, 1),
+            'failed': exc_info[0] is not None,
+        }
+        with open(metrics_file, 'a') as f:
+            f.write(json.dumps(self.record, default=str) + '\n')
+        return False
+
+
+class DisabledStage:
+    """Stand-in for Stage while instrumentation is off."""
+    record = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_disabled = DisabledStage()
+
+
+# Function to instrument a block of work: 'with stage("extract_month", var=var, file=path):'
+def stage(name, **fields):
+    if metrics_file is None:
+        return _disabled
+    return Stage(name, fields)
+
+
+# Function to instrument every call of a function as a stage; with `per_file`, the first argument is its input file
+def instrumented(name, per_file=False):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if metrics_file is None:
+                return func(*args, **kwargs)
+            with stage(name, **({'file': args[0]} if per_file else {})):
+                if per_file:
+                    count_file(args[0])
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# Function to count a file opened by the open stages
+def count_file(path):
+    for active in _active:
+        active.files += 1
+
+
+# Function to count selections (e.g. one pointwise isel over all stations) made by the open stages
+def count_selection(n=1):
+    for active in _active:
+        active.selections += n
+
+
+# Function to turn instrumentation on for this process and the workers it starts
+def enable(path):
+    global metrics_file, run_id
+    metrics_file = os.path.abspath(path)
+    os.makedirs(os.path.dirname(metrics_file), exist_ok=True)
+    os.environ['DAES_METRICS'] = metrics_file
+    if run_id is None:
+        start_run()
+
+
+# Function to start a run: records get its id, and its summary table is printed at exit
+def start_run():
+    global run_id
+    run_id = f"{pd.Timestamp.now():%Y%m%dT%H%M%S}-{os.getpid()}"
+    os.environ['DAES_METRICS_RUN'] = run_id
+    atexit.register(print_summary)
+
+
+# Function to load the metrics records of a run (default: the current one)
+def load_metrics(path=None, run=None):
+    path = path or metrics_file
+    run = run or run_id
+    with open(path) as f:
+        records = pd.DataFrame([json.loads(line) for line in f if line.strip()])
+    if run is not None and not records.empty:
+        records = records[records['run'] == run]
+    return records
+
+
+# Function to summarise the records per stage: calls, wall time, bytes, files, selections and memory
+def summarize_metrics(records):
+    grouped = records.groupby('stage', sort=False)
+    return pd.DataFrame({
+        'calls': grouped.size(),
+        'wall_s': grouped['wall_s'].sum().round(2),
+        'max_wall_s': grouped['wall_s'].max().round(2),
+        'read_mb': (grouped['bytes_read'].sum(min_count=1) / 1e6).round(1),
+        'files': grouped['files'].sum(),
+        'selections': grouped['selections'].sum(),
+        'max_rss_growth_mb': grouped['rss_growth_mb'].max(),
+        'process_peak_rss_mb': grouped['process_peak_rss_mb'].max(),
+    })
+
+
+# Function to print the summary table of the current run
+def print_summary():
+    if metrics_file is None or not os.path.exists(metrics_file):
+        return
+    records = load_metrics()
+    if records.empty:
+        return
+    print(f"Stage metrics of run {run_id} (records in {metrics_file}):")
+    print(summarize_metrics(records).to_string())
+
+
+# A process started with DAES_METRICS set but no run id is the start of a run
+if metrics_file is not None and run_id is None:
+    start_run()
@@ -1,78 +1,135 @@
 import os
+import sys
 import pandas as pd
 import xarray as xr
 import numpy as np
 from calendar import monthrange
 
+# Shared ERA5 extraction helpers live one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from era5_utils import Manifest, load_stations, stability_month
+from instrumentation import stage
+from stability import INDICES, UNITS, stability_indices, stability_levels
+
 # Define paths
 station_file = '/scratch/k10/ef7927/research_project/csv/all_stations/stations_coordinate.csv'
 temp_data_path = '/g/data/rt52/era5/pressure-levels/reanalysis/t/'
 rh_data_path = '/g/data/rt52/era5/pressure-levels/reanalysis/r/'
 output_file = '/scratch/k10/ef7927/research_project/codes/kindex/kindex_all_days.nc'
 
-# Load station data
-stations_df = pd.read_csv(station_file).rename(columns=lambda x: x.strip())
-
-# Validate required columns
-if not {'longitude', 'latitude'}.issubset(stations_df.columns):
-    raise ValueError("Missing required columns: 'longitude' and 'latitude'")
+# Load station data with its cached ERA5 grid index (validates the required columns)
+stations_df = load_stations(station_file)
 
 # Function to construct NetCDF file path
 def get_netcdf_file(base_path, var, year, month):
     days = monthrange(year, month)[1]
     return os.path.join(base_path, str(year), f"{var}_era5_oper_pl_{year}{month:02d}01-{year}{month:02d}{days}.nc")
 
-# Function to compute dew point temperature
-def dew_point(T, RH):
-    return T - ((100 - RH) / 5.0)
-
-# Pressure levels for K-Index calculation
-pressure_levels = [500, 700, 850]
-
-# Initialize a list to collect all station data
-all_k_index_data = []
-
-# Process each station
-for _, station in stations_df.iterrows():
-    lon, lat = station['longitude'], station['latitude']
-
-    for year in range(2015, 2024):
-        for month in range(1, 13):
-            temp_file = get_netcdf_file(temp_data_path, 't', year, month)
-            rh_file = get_netcdf_file(rh_data_path, 'r', year, month)
-
-            if not os.path.exists(temp_file) or not os.path.exists(rh_file):
-                print(f"Missing data for {year}-{month:02d}, skipping.")
-                continue
-
-            with xr.open_dataset(temp_file) as temp_data, xr.open_dataset(rh_file) as rh_data:
-                for day in range(1, monthrange(year, month)[1] + 1):
-                    for hour in range(24):
-                        time = f"{year}-{month:02d}-{day:02d}T{hour:02d}:00"
-                        temp = temp_data.sel(time=time, longitude=lon, latitude=lat, level=pressure_levels, method='nearest')
-                        rh = rh_data.sel(time=time, longitude=lon, latitude=lat, level=[700, 850], method='nearest')
-
-                        T_500, T_700, T_850 = temp.t.sel(level=500).values - 273.15, \
-                                              temp.t.sel(level=700).values - 273.15, \
-                                              temp.t.sel(level=850).values - 273.15
-                        TD_700 = dew_point(T_700, rh.r.sel(level=700).values)
-                        TD_850 = dew_point(T_850, rh.r.sel(level=850).values)
-
-                        K_index = (T_850 - T_500) + TD_850 - (T_700 - TD_700)
-
-                        all_k_index_data.append({'time': time, 'longitude': lon, 'latitude': lat, 'K_index': K_index})
-
-# Convert all collected data into a DataFrame
-if all_k_index_data:
-    df = pd.DataFrame(all_k_index_data)
-    df['time'] = pd.to_datetime(df['time'])
-
-    # Convert DataFrame to an xarray Dataset
-    k_index_ds = xr.Dataset(
-        {'K_index': (['time', 'longitude', 'latitude'], df.pivot_table(index='time', columns=['longitude', 'latitude'], values='K_index').values)},
-        coords={'time': df['time'].values, 'longitude': df['longitude'].unique(), 'latitude': df['latitude'].unique()}
-    )
+# Compute whole months for all stations as array operations (False: original per-hour selections, one
+# station and hour at a time, to validate the station selection of the vectorized path; same indices)
+vectorized = True
+
+# 'python kindex_all_days.py update' only adds the months after those already in output_file
+update = 'update' in sys.argv[1:]
+
+# Months to compute: 2015-2023, or in update mode the later months that have both ERA5 files
+months = [(year, month) for year in range(2015, 2024) for month in range(1, 13)]
+previous_ds = None
+if update and os.path.exists(output_file):
+    with xr.open_dataset(output_file) as previous:
+        previous_ds = previous.load()
+
+if previous_ds is not None and ('station' not in previous_ds.dims
+                                or previous_ds['station'].values.tolist() != stations_df['station'].tolist()):
+    # Written for other stations, or on the earlier (time, longitude, latitude) grid: recompute every month
+    print(f"Station list differs from {output_file}; computing all months.")
+    previous_ds = None
+elif previous_ds is not None and not set(INDICES).issubset(previous_ds.data_vars):
+    # Written before the other stability indices were added: recompute every month
+    print(f"{output_file} lacks some stability indices; computing all months.")
+    previous_ds = None
+elif previous_ds is not None:
+    last = pd.Timestamp(previous_ds['time'].values[-1])
+    months = [(year, month) for year in range(2015, pd.Timestamp.now().year + 1) for month in range(1, 13)
+              if (year, month) > (last.year, last.month)
+              and os.path.exists(get_netcdf_file(temp_data_path, 't', year, month))
+              and os.path.exists(get_netcdf_file(rh_data_path, 'r', year, month))]
+
+# One (time, station) Dataset per month, labelled like the all-days series of era5_utils.select_stations
+monthly = []
+station_coords = {
+    'station': stations_df['station'].values,
+    'latitude': ('station', stations_df['latitude'].values),
+    'longitude': ('station', stations_df['longitude'].values),
+}
+
+if vectorized:
+    # Each month's indices are checkpointed so a job killed at the walltime limit can resume
+    parts_dir = os.path.join(os.path.dirname(output_file), 'kindex_parts')
+    os.makedirs(parts_dir, exist_ok=True)
+    manifest = Manifest(os.path.join(parts_dir, 'manifest.json'))
+
+    for year, month in months:
+        key = f"stability_{year}{month:02d}"
+        part_file = os.path.join(parts_dir, f"{key}.nc")
+        input_files = [f for f in (station_file,
+                                   get_netcdf_file(temp_data_path, 't', year, month),
+                                   get_netcdf_file(rh_data_path, 'r', year, month)) if os.path.exists(f)]
+
+        if manifest.done(key, input_files):
+            # Completed by an earlier run with the same inputs
+            with xr.open_dataset(part_file) as part:
+                indices = part.load()
+        else:
+            with stage('kindex_month', year=year, month=month):
+                # Every stability index (see stability.py) as (time, station) arrays, read from the
+                # regional cache when it covers the month, else from the ERA5 files
+                indices = stability_month(stations_df, year, month)
+                if indices is None:
+                    print(f"Missing data for {year}-{month:02d}, skipping.")
+                    continue
+
+                indices.to_netcdf(part_file)
+                manifest.record(key, input_files, part_file)
+
+        monthly.append(indices)
+else:
+    for year, month in months:
+        temp_file = get_netcdf_file(temp_data_path, 't', year, month)
+        rh_file = get_netcdf_file(rh_data_path, 'r', year, month)
+
+        if not os.path.exists(temp_file) or not os.path.exists(rh_file):
+            print(f"Missing data for {year}-{month:02d}, skipping.")
+            continue
+
+        times = pd.date_range(f"{year}-{month:02d}-01", periods=monthrange(year, month)[1] * 24, freq='h')
+        values = {name: np.full((len(times), len(stations_df)), np.nan) for name in INDICES}
+
+        with xr.open_dataset(temp_file) as temp_data, xr.open_dataset(rh_file) as rh_data:
+            # Process each station, one hour at a time
+            for s, station in enumerate(stations_df.itertuples()):
+                lon, lat = station.longitude, station.latitude
+                for h, time in enumerate(times):
+                    temp = temp_data['t'].sel(time=time, longitude=lon, latitude=lat, level=stability_levels, method='nearest')
+                    rh = rh_data['r'].sel(time=time, longitude=lon, latitude=lat, level=stability_levels, method='nearest')
+
+                    indices = stability_indices(temp, rh)
+                    for name in INDICES:
+                        values[name][h, s] = indices[name].item()
+
+        monthly.append(xr.Dataset({name: (('time', 'station'), values[name], {'units': UNITS[name]}) for name in INDICES},
+                                  coords={'time': times, **station_coords}))
+
+# Join the months along time, straight from their arrays
+if monthly:
+    k_index_ds = xr.concat(monthly, dim='time', data_vars='minimal', coords='minimal', compat='override')
+
+    # In update mode the new months follow the hours already saved
+    if previous_ds is not None:
+        k_index_ds = xr.concat([previous_ds, k_index_ds], dim='time', data_vars='minimal', coords='minimal', compat='override')
 
     # Save the combined dataset to a single NetCDF file
     k_index_ds.to_netcdf(output_file)
-    print(f"All K-Index data saved to {output_file}")
\ No newline at end of file
+    print(f"All stability index data saved to {output_file}")
+elif previous_ds is not None:
+    print(f"{output_file} is up to date.")
\ No newline at end of file
@@ -0,0 +1,168 @@
+import numpy as np
+import xarray as xr
+
+# Physical constants (SI, pressures in hPa)
+Rd = 287.04      # gas constant of dry air, J/(kg K)
+Cp = 1005.7      # specific heat of dry air at constant pressure, J/(kg K)
+Lv = 2.501e6     # latent heat of vaporisation, J/kg
+epsilon = 0.622  # ratio of the molecular weights of water vapour and dry air
+kappa = Rd / Cp
+g = 9.80665
+
+# Pressure levels the indices need: the t and r profiles must hold all of them
+stability_levels = [300, 500, 700, 850, 925, 1000]
+
+# Lifted-index parcel: mean temperature and dew point of these levels, lifted from their mean pressure.
+# ERA5 pressure levels have no surface pressure, so this near-surface layer stands in for the mixed layer.
+parcel_levels = [1000, 925]
+
+# Moist-ascent steps of a lifted parcel (fourth-order Runge-Kutta in pressure)
+moist_steps = 20
+
+
+# Function to compute the saturation vapour pressure (hPa) over water, Magnus formula, T in degrees C
+def saturation_vapor_pressure(t_c):
+    return 6.112 * np.exp(17.67 * t_c / (t_c + 243.5))
+
+
+# Function to compute the dew point (degrees C) from temperature (degrees C) and relative humidity (%), Magnus formula
+def magnus_dewpoint(t_c, rh):
+    # ERA5 humidity can be 0 or above 100 % (saturation over ice); the dew point is kept at or below T
+    gamma = np.log(np.clip(rh, 0.1, 100.0) / 100.0) + 17.67 * t_c / (t_c + 243.5)
+    return 243.5 * gamma / (17.67 - gamma)
+
+
+# Function to get the pseudoadiabatic lapse rate dT/dp (K/hPa) at pressure p (hPa) and temperature t (K)
+def moist_lapse_rate(p, t):
+    es = saturation_vapor_pressure(t - 273.15)
+    rs = epsilon * es / (p - es)
+    return (Rd * t + Lv * rs) / (p * (Cp + Lv ** 2 * rs * epsilon / (Rd * t ** 2)))
+
+
+# Function to lift parcels from p0 (hPa) to p_top, dry to their LCL and moist above it
+def lift_parcel(p0, t0, td0, p_top):
+    """Return the parcel temperature (K) at `p_top` for arrays of start pressure, temperature and dew point (K)."""
+    # Lifting condensation level (Bolton 1980)
+    t_lcl = 1 / (1 / (td0 - 56) + np.log(t0 / td0) / 800) + 56
+    p_lcl = p0 * (t_lcl / t0) ** (1 / kappa)
+
+    # Dry adiabat up to the LCL, or all the way for parcels that saturate above p_top
+    p = np.maximum(p_lcl, p_top)
+    t = t0 * (p / p0) ** kappa
+
+    # Same number of steps for every parcel, so the ascent stays one array operation
+    h = (p_top - p) / moist_steps
+    for _ in range(moist_steps):
+        k1 = moist_lapse_rate(p, t)
+        k2 = moist_lapse_rate(p + h / 2, t + h / 2 * k1)
+        k3 = moist_lapse_rate(p + h / 2, t + h / 2 * k2)
+        k4 = moist_lapse_rate(p + h, t + h * k3)
+        t = t + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        p = p + h
+    return t
+
+
+class Profiles:
+    """Temperature and humidity profiles of many points (e.g. time x station), read once.
+
+    Level temperatures and Magnus dew points are computed on first use and shared by
+    every index, so an extra index costs its own arithmetic only.
+    """
+
+    def __init__(self, t, r):
+        self.t_k = t.astype('float64')
+        self.r = r.astype('float64').transpose(*t.dims)
+        self.levels = [level for level in t['level'].values.tolist() if level in r['level'].values.tolist()]
+        self.cache = {}
+
+    def cached(self, key, compute):
+        if key not in self.cache:
+            self.cache[key] = compute()
+        return self.cache[key]
+
+    def t(self, level):
+        """Temperature (degrees C) at a level."""
+        return self.cached(('t', level), lambda: self.t_k.sel(level=level).values - 273.15)
+
+    def rh(self, level):
+        return self.cached(('rh', level), lambda: self.r.sel(level=level).values)
+
+    def td(self, level):
+        """Dew point (degrees C) at a level."""
+        return self.cached(('td', level), lambda: magnus_dewpoint(self.t(level), self.rh(level)))
+
+
+# Function to compute the K-index: (T850 - T500) + Td850 - (T700 - Td700)
+def k_index(profiles):
+    return (profiles.t(850) - profiles.t(500)) + profiles.td(850) - (profiles.t(700) - profiles.td(700))
+
+
+# Function to compute the Total Totals index: T850 + Td850 - 2 T500
+def total_totals(profiles):
+    return profiles.t(850) + profiles.td(850) - 2 * profiles.t(500)
+
+
+# Function to compute the Lifted Index: T500 minus the 500 hPa temperature of the near-surface parcel
+def lifted_index(profiles):
+    t0 = np.mean([profiles.t(level) for level in parcel_levels], axis=0) + 273.15
+    td0 = np.mean([profiles.td(level) for level in parcel_levels], axis=0) + 273.15
+    parcel = lift_parcel(np.mean(parcel_levels), t0, td0, 500.0)
+    return profiles.t(500) + 273.15 - parcel
+
+
+# Function to compute the Showalter index: T500 minus the 500 hPa temperature of the 850 hPa parcel
+def showalter_index(profiles):
+    parcel = lift_parcel(850.0, profiles.t(850) + 273.15, profiles.td(850) + 273.15, 500.0)
+    return profiles.t(500) + 273.15 - parcel
+
+
+# Function to compute the precipitable water (mm) of the profile levels, a proxy for the full-column tcwv
+def precipitable_water(profiles):
+    levels = sorted(profiles.levels)
+    e = [profiles.rh(level) / 100 * saturation_vapor_pressure(profiles.t(level)) for level in levels]
+    q = np.array([epsilon * e_l / (level - (1 - epsilon) * e_l) for e_l, level in zip(e, levels)])
+
+    # Trapezoids of specific humidity over pressure (Pa), divided by g
+    dp = np.diff(levels) * 100.0
+    return np.tensordot(dp, (q[1:] + q[:-1]) / 2, axes=1) / g
+
+
+# Stability indices by output name. Adding an index only needs a function of a Profiles and an entry here.
+INDICES = {
+    'K_index': k_index,
+    'total_totals': total_totals,
+    'lifted_index': lifted_index,
+    'showalter': showalter_index,
+    'pw_proxy': precipitable_water,
+}
+
+# Units of the indices, kept as attributes of the output
+UNITS = {
+    'K_index': 'degC',
+    'total_totals': 'degC',
+    'lifted_index': 'K',
+    'showalter': 'K',
+    'pw_proxy': 'mm',
+}
+
+
+# Function to compute several stability indices from one read of temperature and humidity profiles
+def stability_indices(t, r, indices=None):
+    """Return a Dataset with one variable per index (default: all of INDICES).
+
+    `t` (K) and `r` (%) are DataArrays with a 'level' dimension (hPa) holding
+    stability_levels, e.g. the (time, station, level) output of select_stations or
+    the (event, level) output of extract_events. Every index is a NumPy array
+    operation over all the other dimensions.
+    """
+    names = list(INDICES) if indices is None else list(indices)
+    unknown = set(names) - set(INDICES)
+    if unknown:
+        raise KeyError(f"Unknown stability indices: {sorted(unknown)}")
+
+    profiles = Profiles(t, r)
+    template = profiles.t_k.isel(level=0, drop=True)
+    out = xr.Dataset({name: template.copy(data=INDICES[name](profiles)) for name in names})
+    for name in names:
+        out[name].attrs = {'units': UNITS[name]}
+    return out
@@ -1,47 +1,33 @@
 import os
-import pandas as pd
+import sys
 import xarray as xr
-import numpy as np
+
+# Shared ERA5 extraction helpers live one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from era5_utils import RunningHistogram, RunningStats, VARIABLES, extract_events, load_event_alignment, profile_summary
 
 # File paths
-csv_path = '/scratch/k10/ef7927/research_project/csv/all_stations/extreme_events.csv'
+alignment_path = '/scratch/k10/ef7927/research_project/csv/all_stations/event_alignment.csv'
 output_dir = '/scratch/k10/ef7927/research_project/netcdf/stations/999/'
 os.makedirs(output_dir, exist_ok=True)
 
-# Read the CSV file
-df = pd.read_csv(csv_path)
- by location
-# Initialize dictionary for temperature profiles by location
-temp_profiles = {}
-
-# Loop through each station in the CSV and process corresponding NetCDF files
-for index, row in df.iterrows():
-    date = pd.to_datetime(row['date'])
-    lon, lat = row['longitude'], row['latitude']
-    year, month = date.year, date.month
-    days_in_month = pd.Period(f'{year}-{month:02d}').days_in_month
-
-    # Construct NetCDF file path
-    nc_file_name = f't_era5_oper_pl_{year}{month:02d}01-{year}{month:02d}{days_in_month:02d}.nc'
-    nc_file_path = f'/g/data/rt52/era5/pressure-levels/reanalysis/t/{year}/{nc_file_name}'
+# Extreme events matched to their ERA5 hour, monthly file and grid cell (see ../align_events.py)
+df = load_event_alignment(alignment_path)
 
-    # Check if the file exists and process it
-    if os.path.exists(nc_file_path):
-        print(f"Processing {nc_file_name} (Row {index+1}/{len(df)})")
-        with xr.open_dataset(nc_file_path) as ds:
-            # Extract temperature data for the specific date, longitude, and latitude
-            temperature_data = ds['t'].sel(time=date, longitude=lon, latitude=lat, method='nearest')
+# Extract temperature profiles at every event's nearest hour and grid point, one monthly file at a time
+temperature_data = extract_events('t', df)
+if temperature_data is None:
+    raise SystemExit("No temperature data found for the extreme events.")
 
-            # Store temperature profile in dictionary
-            temp_profiles.setdefault((lon, lat), []).append(temperature_data)
+# Statistics of each location's profiles, updated as its events are written; the profiles themselves are not kept
+profile_stats = {}
 
-    else:
-        print(f"NetCDF file not found: {nc_file_path}")
-
-# Save each location's temperature profile to a separate NetCDF file
-for (lon, lat), temp_data_list in temp_profiles.items():
-    # Concatenate temperature data along the time dimension
-    temperature_array = xr.concat([data.drop_vars(['longitude', 'latitude']) for data in temp_data_list], dim='time')
+# Save each location's temperature profile to a separate NetCDF file, in the row order of the CSV
+events = df.iloc[temperature_data['event'].values]
+for (lon, lat), location_events in events.groupby(['longitude', 'latitude'], sort=False):
+    # Temperature data of this location along the time dimension
+    temperature_array = (temperature_data.sel(event=location_events.index.values)
+                         .swap_dims(event='time').drop_vars(['event', 'longitude', 'latitude']))
 
     # Create and save the Dataset for this location
     ds_out = xr.Dataset(
@@ -52,16 +38,20 @@ for (lon, lat), temp_data_list in temp_profiles.items():
     ds_out.to_netcdf(os.path.join(output_dir, nc_output_file))
     print(f"Saved temperature profile for {lon}, {lat} to {nc_output_file}")
 
-# Step 5: Calculate the mean vertical profile for each location and combine all profiles
-mean_profiles = {
-    location: xr.concat(profiles, dim='time').mean(dim='time')
-    for location, profiles in temp_profiles.items()
-}
-
-# Create a combined dataset for all locations
-data_arrays = [profile.expand_dims({'station': [location]}) for location, profile in mean_profiles.items()]
-combined_dataset = xr.concat(data_arrays, dim='station')
-
-# Save the combined dataset with mean vertical temperature profiles
+    stats, histogram = RunningStats(), RunningHistogram(VARIABLES['t']['bins'])
+    stats.update(temperature_array)
+    histogram.update(temperature_array)
+    profile_stats[(lon, lat)] = (stats, histogram)
+
+# Step 5: Mean, standard deviation and percentiles of the vertical profile at each location, as in t_all_days.nc
+summaries = [
+    profile_summary('t', stats, histogram)
+    .expand_dims(station=[i])
+    .assign_coords(longitude=('station', [lon]), latitude=('station', [lat]))
+    for i, ((lon, lat), (stats, histogram)) in enumerate(profile_stats.items())
+]
+combined_dataset = xr.concat(summaries, dim='station')
+
+# Save the combined dataset with the vertical temperature profile statistics
 combined_dataset.to_netcdf('/scratch/k10/ef7927/research_project/netcdf/t_extreme_days.nc')
-print("Combined dataset saved to t_extreme_days.nc")
\ No newline at end of file
+print("Combined dataset saved to t_extreme_days.nc")
@@ -1,65 +1,62 @@
 import os
+import sys
 import xarray as xr
 import numpy as np
-import calendar
 
-# Define directories and years
-u_dir = '/g/data/rt52/era5/pressure-levels/reanalysis/u/'
-v_dir = '/g/data/rt52/era5/pressure-levels/reanalysis/v/'
+# Shared ERA5 helpers live one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from era5_utils import Manifest, RunningStats, get_netcdf_file, region_month_stats
+from instrumentation import stage
+
+# Define years (the u/v file paths come from era5_utils)
 years = range(2015, 2024)
 
 # Define latitude and longitude ranges for slicing
 lat_range = slice(5.0, -5.0)  # This remains unchanged
 lon_range = slice(95.0, 105.0)  # This remains unchanged
+region = {'latitude': lat_range, 'longitude': lon_range}
+
+# Define the target pressure levels
+target_levels = [100, 200, 300, 500, 700, 850, 925, 1000]
+
+# Step 5 output path; each month's statistics are checkpointed next to it so a killed job can resume
+output_path = f'/scratch/k10/ef7927/research_project/codes/wind/wind_time_avg_levels_all_days.nc'
+parts_dir = os.path.join(os.path.dirname(output_path), 'wind_all_days_parts')
+os.makedirs(parts_dir, exist_ok=True)
+manifest = Manifest(os.path.join(parts_dir, 'manifest.json'))
 
-# Function to load and slice data
-def load_and_slice(file_path, time_range, lat_range, lon_range):
-    ds = xr.open_dataset(file_path)
-    print(f"Loaded {file_path} with dimensions: {ds.dims}")  # Debugging output
-    print(f"Available coordinates: {ds.coords}")  # Debugging output
-    print(f"Latitude values: {ds['latitude'].values}")  # Debugging output
-    
-    # Slicing only the time dimension
-    ds_sliced = ds.sel(time=time_range)
-    print(f"Sliced {file_path} to dimensions (before geographical slicing): {ds_sliced.dims}")  # Debugging output
-
-    # Slicing for latitude and longitude
-    ds_sliced_geo = ds_sliced.sel(latitude=lat_range, longitude=lon_range)
-    print(f"Sliced {file_path} to dimensions (after geographical slicing): {ds_sliced_geo.dims}")  # Debugging output
-    return ds_sliced_geo
-
-# Initialize lists to hold data
-u_data_list = []
-v_data_list = []
+# Running mean and variance per grid cell and level; only one month is held in memory
+u_stats = RunningStats(dim='time')
+v_stats = RunningStats(dim='time')
 
 # Loop through years and months
 for year in years:
     for month in range(1, 13):
-        # Get the last day of the month
-        last_day = calendar.monthrange(year, month)[1]  # Gives the correct number of days for the month
-        
-        # Define file pattern based on month and year
-        u_file = '{}/u_era5_oper_pl_{}{:02d}01-{}{:02d}{:02d}.nc'.format(u_dir + str(year), year, month, year, month, last_day)
-        v_file = '{}/v_era5_oper_pl_{}{:02d}01-{}{:02d}{:02d}.nc'.format(v_dir + str(year), year, month, year, month, last_day)
-        
-        # Load and slice u component
-        if os.path.exists(u_file):
-            u_data_list.append(load_and_slice(u_file, slice(None), lat_range, lon_range))  # Keep all time data
-        
-        # Load and slice v component
-        if os.path.exists(v_file):
-            v_data_list.append(load_and_slice(v_file, slice(None), lat_range, lon_range))  # Keep all time data
-
-# Concatenate data along time dimension
-u_combined = xr.concat(u_data_list, dim='time')
-v_combined = xr.concat(v_data_list, dim='time')
-
-# Step 2: Define the target pressure levels
-target_levels = [100, 200, 300, 500, 700, 850, 925, 1000]
-
-# Step 3: Select the U and V components for the specific levels and time-average them
-u_selected = u_combined['u'].sel(level=target_levels).mean(dim='time')
-v_selected = v_combined['v'].sel(level=target_levels).mean(dim='time')
+        for var, stats in (('u', u_stats), ('v', v_stats)):
+            key = f"{var}_{year}{month:02d}"
+            part_file = os.path.join(parts_dir, f"{key}.nc")
+            input_files = [f for f in [get_netcdf_file(var, year, month)] if os.path.exists(f)]
+
+            # Reuse the month's statistics from an earlier run when nothing has changed
+            if manifest.done(key, input_files):
+                with xr.open_dataset(part_file) as part:
+                    stats.merge(RunningStats.from_dataset(part.load()))
+                continue
+
+            # Per-month wall time, bytes read and memory go to the metrics file when DAES_METRICS is set
+            with stage('wind_all_days', var=var, year=year, month=month, file=get_netcdf_file(var, year, month)):
+                # All hours of the month over the box, from the regional cache when it covers the month
+                month_stats = region_month_stats(var, year, month, target_levels, region)
+                if month_stats is None:
+                    continue
+
+                month_stats.to_dataset().to_netcdf(part_file)
+                manifest.record(key, input_files, part_file)
+            stats.merge(month_stats)
+
+# Step 3: Time-averaged U and V components at the target levels
+u_selected = u_stats.mean
+v_selected = v_stats.mean
 
 # Step 4: Calculate Wind Speed and Wind Direction for the time-averaged data
 wind_speed = np.sqrt(u_selected**2 + v_selected**2)  # Wind speed
@@ -71,12 +68,14 @@ print(f"Wind Speed shape: {wind_speed.shape}, sample values:\n{wind_speed.isel(l
 print(f"Wind Direction shape: {wind_direction.shape}, sample values:\n{wind_direction.isel(level=0).values[:5, :5]}")
 
 # Step 5: Save the time-averaged wind speed and direction to a new NetCDF file
-output_path = f'/scratch/k10/ef7927/research_project/codes/wind/wind_time_avg_levels_all_days.nc'
 
 ds_out = xr.Dataset(
     {
         'wind_speed': (['level', 'latitude', 'longitude'], wind_speed.data),
         'wind_direction': (['level', 'latitude', 'longitude'], wind_direction.data),
+        'u_std': (['level', 'latitude', 'longitude'], u_stats.std().data),
+        'v_std': (['level', 'latitude', 'longitude'], v_stats.std().data),
+        'count': (['level', 'latitude', 'longitude'], u_stats.count.data),
     },
     coords={
         'latitude': u_selected.latitude,
@@ -90,11 +89,12 @@ ds_out['wind_speed'].attrs['units'] = 'm/s'
 ds_out['wind_direction'].attrs['units'] = 'degrees'
 ds_out['wind_speed'].attrs['description'] = 'Time-averaged wind speed'
 ds_out['wind_direction'].attrs['description'] = 'Time-averaged wind direction'
+ds_out['u_std'].attrs['units'] = 'm/s'
+ds_out['v_std'].attrs['units'] = 'm/s'
+ds_out['u_std'].attrs['description'] = 'Standard deviation of the U component over time'
+ds_out['v_std'].attrs['description'] = 'Standard deviation of the V component over time'
+ds_out['count'].attrs['description'] = 'Number of hourly fields averaged'
 
 # Save to NetCDF
 ds_out.to_netcdf(output_path)
-print(f"Time-averaged wind data saved to {output_path}")
-
-# Close the datasets to free up resources
-u_combined.close()
-v_combined.close()
\ No newline at end of file
+print(f"Time-averaged wind data saved to {output_path}")
\ No newline at end of file
@@ -0,0 +1,473 @@
+import operator
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs
+
+# Stage metrics are shared with the ERA5 extraction (see environment_conditions/instrumentation.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'environment_conditions'))
+from instrumentation import count_file, instrumented, stage
+
+# Aggregation periods of the 10-minute observations: output name -> pandas offset alias
+PERIODS = {
+    'daily': 'D',
+    '3hourly': '3h',
+    'hourly': 'h',
+}
+
+# Percentiles of the station extreme-rainfall thresholds
+threshold_percentiles = [99, 99.5, 99.9, 99.99]
+
+# Typed columns of the Parquet observation store, partitioned by station and year (hive layout:
+# <dataset>/station=<name>/year=<yyyy>/part-0.parquet)
+OBSERVATION_SCHEMA = pa.schema([('date', pa.timestamp('ns')), ('station', pa.string()), ('rr', pa.float64()), ('year', pa.int16())])
+PARTITIONING = ds.partitioning(pa.schema([('station', pa.string()), ('year', pa.int16())]), flavor='hive')
+
+
+# Function to list the station CSV files of a directory in a stable order
+def list_station_files(input_dir):
+    return sorted(os.path.join(input_dir, f) for f in os.listdir(input_dir) if f.endswith('.csv'))
+
+
+# Function to read one station's 10-minute CSV with typed columns
+def read_10m(file_path):
+    df = pd.read_csv(file_path, usecols=['date', 'station', 'rr'])
+    df['station'] = df['station'].astype(str).str.strip()
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    df['rr'] = pd.to_numeric(df['rr'], errors='coerce')
+    return df.dropna(subset=['date'])
+
+
+# Function to aggregate one station's 10-minute file to several periods from a single read
+@instrumented('aggregate_station', per_file=True)
+def aggregate_station(file_path, periods=('daily',)):
+    """Return {period: DataFrame(date, station, rr)} with the rainfall summed over each period."""
+    df = read_10m(file_path)
+    if df.empty:
+        return {}
+
+    # Only the rainfall is summed; the station name is set once for the whole file
+    station = df['station'].iloc[0]
+    rr = df.set_index('date')['rr']
+    return {
+        name: rr.resample(PERIODS[name]).sum().rename_axis('date').reset_index().assign(station=station)[['date', 'station', 'rr']]
+        for name in periods
+    }
+
+
+# Function to get the output file of an aggregation period
+def get_output_file(output_dir, period):
+    return os.path.join(output_dir, f"{period}_precipitation.csv")
+
+
+# Function to convert every station's 10-minute file to consolidated period totals
+def convert_10m(input_dir, output_dir, periods=('daily',), workers=None, update=False):
+    """Write one CSV per period (e.g. daily_precipitation.csv) with the totals of all stations.
+
+    Station files are converted in a process pool of `workers` processes (default: all
+    cores). With `update`, only the stations whose 10-minute file changed after the
+    outputs were written are converted again; the rows of the other stations are kept.
+    """
+    unknown = set(periods) - set(PERIODS)
+    if unknown:
+        raise KeyError(f"Unknown aggregation periods: {sorted(unknown)}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    files = list_station_files(input_dir)
+    output_files = {name: get_output_file(output_dir, name) for name in periods}
+
+    kept = {name: [] for name in periods}
+    if update and all(os.path.exists(f) for f in output_files.values()):
+        written = min(os.path.getmtime(f) for f in output_files.values())
+        files = [f for f in files if os.path.getmtime(f) > written]
+        changed = {pd.read_csv(f, usecols=['station'], nrows=1)['station'].astype(str).str.strip().iloc[0] for f in files}
+        for name, output_file in output_files.items():
+            saved = pd.read_csv(output_file, parse_dates=['date'])
+            kept[name] = [saved[~saved['station'].isin(changed)]]
+        if not files:
+            print("All station files are already converted.")
+            return
+
+    workers = workers or os.cpu_count()
+    if workers > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(aggregate_station, files, [periods] * len(files)))
+    else:
+        results = [aggregate_station(f, periods) for f in files]
+
+    for name, output_file in output_files.items():
+        frames = kept[name] + [result[name] for result in results if name in result]
+        combined = pd.concat(frames, ignore_index=True).sort_values(['station', 'date'], kind='stable')
+        combined.to_csv(output_file, index=False)
+        print(f"{len(files)} station file(s) converted; {name} totals saved to {output_file}")
+
+
+class ExactQuantiles:
+    """Exact quantiles of a stream of values, kept as counts of each distinct value.
+
+    Gauge rainfall is recorded to 0.1 mm, so a station's whole record reduces to a
+    few hundred (value, count) pairs. Quantiles match pandas' linear interpolation.
+    """
+
+    def __init__(self):
+        self.values = np.empty(0)
+        self.counts = np.empty(0, dtype='int64')
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        new_values, new_counts = np.unique(values[~np.isnan(values)], return_counts=True)
+        self.merge_counts(new_values, new_counts)
+
+    def merge(self, other):
+        self.merge_counts(other.values, other.counts)
+
+    def merge_counts(self, values, counts):
+        all_values = np.concatenate([self.values, values])
+        unique, inverse = np.unique(all_values, return_inverse=True)
+        self.values = unique
+        self.counts = np.bincount(inverse, weights=np.concatenate([self.counts, counts]),
+                                  minlength=len(unique)).astype('int64')
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def quantile(self, q):
+        """Quantiles (0-1), interpolated between order statistics as in Series.quantile."""
+        if self.count == 0:
+            return np.full(np.shape(q), np.nan)
+        cumulative = np.cumsum(self.counts)
+        position = (self.count - 1) * np.asarray(q, dtype=float)
+        lower = np.floor(position)
+
+        # Value of the i-th smallest observation (0-based) from the cumulative counts
+        def order_statistic(i):
+            return self.values[np.searchsorted(cumulative, i, side='right')]
+
+        below = order_statistic(lower)
+        above = order_statistic(np.minimum(lower + 1, self.count - 1))
+        return below + (position - lower) * (above - below)
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch of non-negative values with bounded relative error.
+
+    Values are counted in logarithmic buckets (as in DDSketch), so any quantile is
+    returned within `relative_accuracy` of the true order statistic, whatever the
+    number of values, from at most a few hundred buckets. Zeros (dry intervals) are
+    counted on their own.
+    """
+
+    def __init__(self, relative_accuracy=0.005):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.zeros = 0
+        self.buckets = {}
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        positive = values[values > 0]
+        self.zeros += len(values) - len(positive)
+
+        keys, counts = np.unique(np.ceil(np.log(positive) / np.log(self.gamma)).astype('int64'), return_counts=True)
+        for key, n in zip(keys.tolist(), counts.tolist()):
+            self.buckets[key] = self.buckets.get(key, 0) + n
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches of different relative accuracy")
+        self.zeros += other.zeros
+        for key, n in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + n
+
+    @property
+    def count(self):
+        return self.zeros + sum(self.buckets.values())
+
+    def quantile(self, q):
+        """Quantiles (0-1), interpolated between the buckets of neighbouring ranks as in Series.quantile."""
+        if self.count == 0:
+            return np.full(np.shape(q), np.nan)
+        keys = np.array(sorted(self.buckets), dtype='int64')
+        cumulative = self.zeros + np.cumsum([self.buckets[k] for k in keys], dtype='int64')
+        values = 2 * self.gamma ** keys.astype(float) / (self.gamma + 1)
+
+        # Representative value of the i-th smallest observation (0-based)
+        def order_statistic(i):
+            index = np.minimum(np.searchsorted(cumulative, i, side='right'), len(values) - 1)
+            return np.where(i < self.zeros, 0.0, values[index]) if len(values) else np.zeros(np.shape(i))
+
+        position = (self.count - 1) * np.asarray(q, dtype=float)
+        lower = np.floor(position)
+        below = order_statistic(lower)
+        above = order_statistic(np.minimum(lower + 1, self.count - 1))
+        return below + (position - lower) * (above - below)
+
+
+# Quantile accumulators by method: 'sketch' for bounded memory, 'exact' to validate it
+QUANTILE_METHODS = {
+    'exact': ExactQuantiles,
+    'sketch': QuantileSketch,
+}
+
+
+# Function to label a threshold column, e.g. '99.9th percentile'
+def percentile_label(percentile):
+    return f"{percentile:g}th percentile"
+
+
+# Function to accumulate the rainfall distribution of one station file, a chunk at a time
+@instrumented('station_quantiles', per_file=True)
+def station_quantiles(file_path, method='sketch', chunksize=1_000_000):
+    """Return (station, accumulator) with every 'rr' value of the file added to it."""
+    accumulator, station = QUANTILE_METHODS[method](), None
+    for chunk in pd.read_csv(file_path, usecols=['station', 'rr'], chunksize=chunksize):
+        # Stripped as in read_10m, so padded names of the same station are merged
+        station = station if station is not None else str(chunk['station'].iloc[0]).strip()
+        accumulator.update(pd.to_numeric(chunk['rr'], errors='coerce').values)
+    return station, accumulator
+
+
+# Function to accumulate the rainfall distribution of one station of a Parquet store
+def dataset_station_quantiles(dataset_dir, station, method='sketch'):
+    accumulator = QUANTILE_METHODS[method]()
+    with stage('station_quantiles', file=dataset_dir, station=station):
+        for batch in open_observations(dataset_dir).to_batches(columns=['rr'], filter=ds.field('station') == station):
+            accumulator.update(batch.column('rr').to_numpy(zero_copy_only=False))
+    return station, accumulator
+
+
+# Function to compute several percentile thresholds per station in one pass over the files
+def compute_thresholds(csv_files, percentiles=threshold_percentiles, method='sketch', workers=None):
+    """Return a DataFrame with a station column and one '<p>th percentile' column per percentile.
+
+    `csv_files` is a list of station CSVs or the directory of a Parquet observation store.
+    Files are read in chunks and in parallel; accumulators of the same station (e.g.
+    one file per year) are merged, so memory does not grow with the record length.
+    """
+    # A Parquet store is read one station at a time, 'rr' only
+    if isinstance(csv_files, str) and is_dataset(csv_files):
+        tasks = (dataset_station_quantiles, [(csv_files, station, method) for station in dataset_stations(csv_files)])
+    else:
+        tasks = (station_quantiles, [(f, method) for f in csv_files])
+
+    workers = workers or os.cpu_count()
+    if workers > 1 and len(tasks[1]) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(tasks[0], *zip(*tasks[1])))
+    else:
+        results = [tasks[0](*args) for args in tasks[1]]
+
+    merged = {}
+    for station, accumulator in results:
+        if station is None:
+            continue
+        if station in merged:
+            merged[station].merge(accumulator)
+        else:
+            merged[station] = accumulator
+
+    q = np.asarray(percentiles, dtype=float) / 100
+    rows = [[station] + np.round(accumulator.quantile(q), 2).tolist() for station, accumulator in merged.items()]
+    return (pd.DataFrame(rows, columns=['station'] + [percentile_label(p) for p in percentiles])
+            .sort_values(by='station')
+            .reset_index(drop=True))
+
+
+# Function to find one station's extreme-rainfall threshold and its exceedances from a single read
+@instrumented('station_extremes', per_file=True)
+def station_extremes(file_path, percentile=99.9):
+    """Return (station, threshold, events) with the events as read (date, station, rr).
+
+    The threshold is the exact percentile of the file's rainfall rounded to 0.01 mm,
+    and an event is any record of the station at or above it: records with no station
+    name are left out, as the baseline's threshold lookup did.
+    """
+    df = pd.read_csv(file_path, usecols=['date', 'station', 'rr'])
+    # Stripped as in read_10m, so thresholds and events match the other outputs by station name
+    df['station'] = df['station'].astype(str).str.strip().where(df['station'].notna())
+    names = df['station'].dropna()
+    if names.empty:
+        return None, np.nan, df.iloc[:0]
+    station = names.iloc[0]
+    threshold = round(df['rr'].quantile(percentile / 100), 2)
+    return station, threshold, df[(df['station'] == station) & (df['rr'] >= threshold)]
+
+
+# Function to identify a station file by its size and modification time (integer nanoseconds, exact through a CSV)
+def file_signature(file_path):
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+# Function to detect the extreme rainfall events of every station and save them with the thresholds
+def detect_extreme_events(csv_files, events_file, thresholds_file, percentile=99.9, workers=None, update=False):
+    """Write `events_file` (date, station, rr) and `thresholds_file`, and return (thresholds, events).
+
+    Each station file is read once, in a process pool, for both its threshold and its
+    events. `thresholds_file` records the size and modification time of every file, so
+    with `update` only the stations whose file changed are read again; the others keep
+    their threshold and their rows of `events_file`.
+    """
+    label = percentile_label(percentile)
+    saved = pd.DataFrame(columns=['file', 'station', 'size', 'mtime_ns', label]).set_index('file')
+    saved_events = pd.DataFrame(columns=['date', 'station', 'rr'])
+    if update and os.path.exists(thresholds_file) and os.path.exists(events_file):
+        saved = pd.read_csv(thresholds_file).set_index('file')
+        saved_events = pd.read_csv(events_file)
+
+    # Files recorded with a float 'mtime' (before mtime_ns) are read again once
+    def unchanged(file_path):
+        name = os.path.basename(file_path)
+        return ('mtime_ns' in saved and name in saved.index
+                and (saved.loc[name, 'size'], saved.loc[name, 'mtime_ns']) == file_signature(file_path))
+
+    changed = [f for f in csv_files if not unchanged(f)]
+    workers = workers or os.cpu_count()
+    if workers > 1 and len(changed) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = dict(zip(changed, pool.map(station_extremes, changed, [percentile] * len(changed))))
+    else:
+        results = {f: station_extremes(f, percentile) for f in changed}
+
+    # Assemble in the order of csv_files, so the events file keeps its row order
+    records, all_results = [], []
+    for file_path in csv_files:
+        if file_path in results:
+            station, threshold, events = results[file_path]
+            if station is None:
+                continue
+            if update:
+                print(f"Recomputed threshold of {station}: {threshold}")
+        else:
+            entry = saved.loc[os.path.basename(file_path)]
+            station, threshold = entry['station'], entry[label]
+            events = saved_events[saved_events['station'] == station]
+        records.append([os.path.basename(file_path), station, *file_signature(file_path), threshold])
+        all_results.append(events)
+
+    thresholds = pd.DataFrame(records, columns=['file', 'station', 'size', 'mtime_ns', label])
+    extreme_events = pd.concat(all_results, ignore_index=True).round(1)
+    extreme_events.to_csv(events_file, index=False)
+    thresholds.to_csv(thresholds_file, index=False)
+    print(f"{len(changed)} station file(s) read; extreme events saved to {events_file}")
+
+    return (thresholds[['station', label]].sort_values(by='station').reset_index(drop=True),
+            extreme_events)
+
+
+# Function to accumulate rainfall sums and counts per station, year and month in one pass
+def monthly_totals(input_path, chunksize=1_000_000):
+    """Return DataFrame(station, year, month, sum, count) from a consolidated CSV, a directory of CSVs or a Parquet store.
+
+    Each chunk is reduced to its partial sums and counts right away and the partials are
+    added at the end, so memory holds the (station, year, month) table, not the rows.
+    """
+    partials = []
+    with stage('monthly_totals', file=input_path):
+        for chunk in iter_chunks(input_path, chunksize):
+            date = pd.to_datetime(chunk['date'])
+            keys = [chunk['station'], date.dt.year.rename('year'), date.dt.month.rename('month')]
+            partials.append(chunk.groupby(keys)['rr'].agg(['sum', 'count']))
+
+    if not partials:
+        return pd.DataFrame(columns=['station', 'year', 'month', 'sum', 'count'])
+    return pd.concat(partials).groupby(level=['station', 'year', 'month']).sum().reset_index()
+
+
+# Function to turn monthly totals into mean rainfall over any grouping of station, year and month
+def monthly_means(totals, by=('month',)):
+    """Mean 'rr' per group of `by`, e.g. ['month'] (all stations and years) or ['station', 'year', 'month']."""
+    grouped = totals.groupby(list(by), as_index=False)[['sum', 'count']].sum()
+    grouped['rr'] = grouped['sum'] / grouped['count']
+    return grouped[list(by) + ['rr']]
+
+
+# Function to write one station file (or a consolidated CSV) into the partitioned Parquet store
+@instrumented('write_partitions', per_file=True)
+def write_partitions(file_path, dataset_dir):
+    """Replace the (station, year) partitions of the file's observations in `dataset_dir`."""
+    df = read_10m(file_path)
+    df['year'] = df['date'].dt.year.astype('int16')
+    table = pa.Table.from_pandas(df, schema=OBSERVATION_SCHEMA, preserve_index=False)
+    ds.write_dataset(table, dataset_dir, format='parquet', partitioning=PARTITIONING,
+                     basename_template='part-{i}.parquet', existing_data_behavior='delete_matching')
+    return len(df)
+
+
+# Function to ingest station CSVs into a Parquet dataset partitioned by station and year
+def ingest_parquet(input_path, dataset_dir, workers=None):
+    """Write a directory of station CSVs (in parallel) or a consolidated CSV to `dataset_dir`.
+
+    Re-ingesting replaces only the partitions of the stations and years being written.
+    """
+    files = [input_path] if input_path.endswith('.csv') else list_station_files(input_path)
+    os.makedirs(dataset_dir, exist_ok=True)
+
+    # Each station writes its own partitions, so files can be written in parallel
+    workers = workers or os.cpu_count()
+    if workers > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows = sum(pool.map(write_partitions, files, [dataset_dir] * len(files)))
+    else:
+        rows = sum(write_partitions(f, dataset_dir) for f in files)
+    print(f"{rows} observations from {len(files)} file(s) saved to {dataset_dir}")
+
+
+# Function to check whether a path is a Parquet observation store
+def is_dataset(path):
+    return os.path.isdir(path) and any(name.startswith('station=') for name in os.listdir(path))
+
+
+# Function to open a Parquet observation store, memory-mapping its files
+def open_observations(dataset_dir):
+    return ds.dataset(os.path.abspath(dataset_dir), format='parquet', partitioning=PARTITIONING,
+                      filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True))
+
+
+# Function to list the stations of a Parquet observation store from its partitions
+def dataset_stations(dataset_dir):
+    fragments = open_observations(dataset_dir).get_fragments()
+    return sorted({ds.get_partition_keys(f.partition_expression)['station'] for f in fragments})
+
+
+# Function to read observations from the Parquet store with column projection and predicate pushdown
+def read_observations(dataset_dir, stations=None, start=None, end=None, columns=('date', 'station', 'rr')):
+    """Return the observations of `stations` between `start` and `end` (inclusive) as a DataFrame.
+
+    Only the partitions of the requested stations and years are opened, and only
+    `columns` are read from them.
+    """
+    filters = []
+    if stations is not None:
+        filters.append(ds.field('station').isin(list(stations)))
+    if start is not None:
+        start = pd.Timestamp(start)
+        filters += [ds.field('year') >= start.year, ds.field('date') >= pa.scalar(start, pa.timestamp('ns'))]
+    if end is not None:
+        end = pd.Timestamp(end)
+        filters += [ds.field('year') <= end.year, ds.field('date') <= pa.scalar(end, pa.timestamp('ns'))]
+
+    table = open_observations(dataset_dir).to_table(columns=list(columns), filter=reduce(operator.and_, filters) if filters else None)
+    sort_keys = [(c, 'ascending') for c in ('station', 'date') if c in columns]
+    return (table.sort_by(sort_keys) if sort_keys else table).to_pandas()
+
+
+# Function to iterate over observations in chunks, from CSV files or a Parquet store
+def iter_chunks(input_path, chunksize=1_000_000, columns=('date', 'station', 'rr')):
+    if is_dataset(input_path):
+        for batch in open_observations(input_path).to_batches(columns=list(columns), batch_size=chunksize):
+            yield batch.to_pandas()
+        return
+
+    files = [input_path] if input_path.endswith('.csv') else list_station_files(input_path)
+    for file_path in files:
+        count_file(file_path)
+        yield from pd.read_csv(file_path, usecols=list(columns), chunksize=chunksize)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The ERA5 and precipitation helpers are imported as top-level modules, as the scripts do
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(repo_dir, 'environment_conditions'))
+sys.path.append(os.path.join(repo_dir, 'precipitation'))
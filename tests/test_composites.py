@@ -0,0 +1,70 @@
+import os
+from calendar import monthrange
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import era5_utils
+from era5_utils import composite_events, get_netcdf_file
+
+latitudes = np.arange(5.0, -5.01, -0.5)
+longitudes = np.arange(95.0, 105.01, 0.5)
+
+# Events across a month boundary, two at the same hour, and one whose later lags fall in a month not on disk
+events = pd.DataFrame({
+    'date': ['2016-01-10 05:10', '2016-01-31 23:40', '2016-01-31 23:50', '2016-02-29 22:00'],
+    'station': ['A', 'B', 'C', 'A'],
+})
+lags = range(-3, 3)
+
+
+@pytest.fixture
+def era5(tmp_path, monkeypatch):
+    monkeypatch.setattr(era5_utils, 'era5_dir', str(tmp_path / 'era5'))
+    monkeypatch.setattr(era5_utils, 'cache_dir', str(tmp_path / 'zarr'))
+    months = []
+    for month in (1, 2):
+        time = pd.date_range(f"2016-{month:02d}-01", periods=monthrange(2016, month)[1] * 24, freq='h')
+        rng = np.random.default_rng(month)
+        values = rng.gamma(1.5, 400.0, (len(time), len(latitudes), len(longitudes))).astype('float32')
+        ds = xr.Dataset({'cape': (('time', 'latitude', 'longitude'), values)},
+                        coords={'time': time, 'latitude': latitudes, 'longitude': longitudes})
+        nc_file = get_netcdf_file('cape', 2016, month)
+        os.makedirs(os.path.dirname(nc_file), exist_ok=True)
+        ds.to_netcdf(nc_file)
+        months.append(ds['cape'].astype('float64'))
+    return xr.concat(months, dim='time')
+
+
+# Function to composite the events one (event, lag) hour at a time, as a reference
+def brute_force(field):
+    hours = (pd.to_datetime(events['date']) + pd.Timedelta('30min')).dt.floor('h')
+    sums, anomalies, counts = [], [], []
+    for lag in lags:
+        times = [t + pd.Timedelta(hours=lag) for t in hours if t + pd.Timedelta(hours=lag) in field.indexes['time']]
+        fields = [field.sel(time=t) for t in times]
+        month_hour_means = [field.sel(time=f"{t:%Y-%m}").groupby('time.hour').mean('time').sel(hour=t.hour) for t in times]
+        counts.append(len(times))
+        sums.append(sum(fields) / len(times))
+        anomalies.append(sum(f - m for f, m in zip(fields, month_hour_means)) / len(times))
+    return np.array(sums), np.array(anomalies), counts
+
+
+def test_composite_matches_brute_force(era5):
+    composite = composite_events('cape', events, lags)
+    expected_mean, expected_anomaly, expected_counts = brute_force(era5)
+
+    assert composite['count'].values.tolist() == expected_counts
+    assert expected_counts[-1] == len(events) - 1
+    np.testing.assert_allclose(composite['cape'].values, expected_mean, rtol=1e-10)
+    np.testing.assert_allclose(composite['cape_anomaly'].values, expected_anomaly, rtol=1e-8, atol=1e-8)
+    assert composite['lag'].values.tolist() == list(lags)
+
+
+def test_composite_without_anomalies(era5):
+    composite = composite_events('cape', events, lags, anomalies=False)
+    expected_mean, _, _ = brute_force(era5)
+    assert 'cape_anomaly' not in composite
+    np.testing.assert_allclose(composite['cape'].values, expected_mean, rtol=1e-10)
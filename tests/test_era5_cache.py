@@ -0,0 +1,47 @@
+import os
+from calendar import monthrange
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import era5_utils
+from era5_utils import cache_month, get_netcdf_file
+
+latitudes = np.arange(6.0, -6.01, -0.25)
+longitudes = np.arange(94.0, 106.01, 0.25)
+
+
+# Function to write one month of CAPE packed to int16 with its own scale and offset, as ERA5 files are
+def write_packed_month(year, month, low, high):
+    time = pd.date_range(f"{year}-{month:02d}-01", periods=monthrange(year, month)[1] * 24, freq='h')
+    rng = np.random.default_rng(month)
+    values = rng.uniform(low, high, (len(time), len(latitudes), len(longitudes))).astype('float32')
+    scale = (high - low) / 65000
+    offset = (high + low) / 2
+
+    nc_file = get_netcdf_file('cape', year, month)
+    os.makedirs(os.path.dirname(nc_file), exist_ok=True)
+    ds = xr.Dataset({'cape': (('time', 'latitude', 'longitude'), values)},
+                    coords={'time': time, 'latitude': latitudes, 'longitude': longitudes})
+    ds.to_netcdf(nc_file, encoding={'cape': {'dtype': 'int16', 'scale_factor': scale, 'add_offset': offset,
+                                             '_FillValue': -32767}})
+    return values, scale
+
+
+def test_appended_months_keep_their_own_packing(tmp_path, monkeypatch):
+    monkeypatch.setattr(era5_utils, 'era5_dir', str(tmp_path / 'era5'))
+    monkeypatch.setattr(era5_utils, 'cache_dir', str(tmp_path / 'zarr'))
+    january, _ = write_packed_month(2016, 1, 0.0, 100.0)
+    february, scale = write_packed_month(2016, 2, 0.0, 5000.0)
+
+    assert cache_month('cape', 2016, 1)
+    assert cache_month('cape', 2016, 2)
+    assert not cache_month('cape', 2016, 2)
+
+    with xr.open_zarr(era5_utils.get_cache_store('cape')) as cached:
+        assert cached['cape'].dtype == 'float32'
+        assert cached['cape'].attrs['lat_offset'] == 4 and cached['cape'].attrs['lon_offset'] == 4
+        np.testing.assert_allclose(cached['cape'].sel(time='2016-01').values, january[:, 4:-4, 4:-4], atol=0.01)
+        np.testing.assert_allclose(cached['cape'].sel(time='2016-02').values, february[:, 4:-4, 4:-4], atol=scale)
+        assert float(cached['cape'].sel(time='2016-02').max()) > 4900
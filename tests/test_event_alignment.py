@@ -0,0 +1,39 @@
+import pandas as pd
+
+from era5_utils import build_event_alignment, nearest_era5_hour
+
+# Events on and around half past the hour, at even and odd hours and across a month boundary
+dates = ['2016-03-05 20:30', '2016-03-05 21:30', '2016-03-05 21:29', '2016-03-05 21:31',
+         '2016-03-31 23:30', '2016-04-01 00:00', '2016-04-01 01:30']
+
+stations = pd.DataFrame({'station': ['AWS HARAU'], 'latitude': [-0.1], 'longitude': [100.67],
+                         'lat_idx': [360], 'lon_idx': [403]})
+
+
+# Hour picked by the baseline: get_indexer(..., method='nearest') on the hourly ERA5 axis
+def baseline_hours(values):
+    values = pd.to_datetime(pd.Series(values))
+    axis = pd.date_range(values.min().floor('D'), values.max().ceil('D'), freq='h')
+    return pd.Series(axis[axis.get_indexer(values, method='nearest')])
+
+
+def test_half_past_goes_to_the_later_hour():
+    hours = nearest_era5_hour(pd.Series(dates))
+    expected = pd.to_datetime(['2016-03-05 21:00', '2016-03-05 22:00', '2016-03-05 21:00', '2016-03-05 22:00',
+                               '2016-04-01 00:00', '2016-04-01 00:00', '2016-04-01 02:00'])
+    assert list(hours) == list(expected)
+
+
+def test_nearest_hour_matches_baseline_selection():
+    minutes = pd.Series(pd.date_range('2016-01-01', periods=48 * 60, freq='min'))
+    assert (nearest_era5_hour(minutes).values == baseline_hours(minutes).values).all()
+
+
+def test_alignment_of_half_past_events():
+    events = pd.DataFrame({'date': dates, 'station': 'AWS HARAU'})
+    table = build_event_alignment(events, stations)
+
+    assert (table['era5_time'].values == baseline_hours(dates).values).all()
+    assert table['file_key'].tolist() == ['201603', '201603', '201603', '201603', '201604', '201604', '201604']
+    assert table['hour_index'].tolist() == [(5 - 1) * 24 + 21, (5 - 1) * 24 + 22, (5 - 1) * 24 + 21,
+                                            (5 - 1) * 24 + 22, 0, 0, 2]
@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import precipitation_utils
+from precipitation_utils import detect_extreme_events
+
+
+# Function to write `n` synthetic 10-minute station files and return their paths
+def make_station_files(directory, n=20, days=30):
+    rng = np.random.default_rng(0)
+    dates = pd.date_range('2015-01-01', periods=days * 144, freq='10min')
+    paths = []
+    for i in range(n):
+        rr = np.round(rng.gamma(0.3, 2.0, len(dates)) * (rng.random(len(dates)) < 0.2), 1)
+        path = directory / f"ARG SYNTHETIC {i:04d}_10m.csv"
+        pd.DataFrame({'date': dates, 'station': f"ARG SYNTHETIC {i:04d}", 'rr': rr}).to_csv(path, index=False)
+        paths.append(str(path))
+    return paths
+
+
+# Function to run detect_extreme_events and count the station files it reads
+def run_counting_reads(monkeypatch, *args, **kwargs):
+    reads = []
+    station_extremes = precipitation_utils.station_extremes
+
+    def counting(file_path, percentile):
+        reads.append(file_path)
+        return station_extremes(file_path, percentile)
+
+    monkeypatch.setattr(precipitation_utils, 'station_extremes', counting)
+    result = detect_extreme_events(*args, workers=1, **kwargs)
+    monkeypatch.setattr(precipitation_utils, 'station_extremes', station_extremes)
+    return reads, result
+
+
+def test_update_with_nothing_changed_reads_no_file(tmp_path, monkeypatch):
+    files = make_station_files(tmp_path)
+    events_file, thresholds_file = tmp_path / 'extreme_events.csv', tmp_path / 'thresholds.csv'
+
+    reads, (thresholds, events) = run_counting_reads(monkeypatch, files, str(events_file), str(thresholds_file))
+    assert len(reads) == len(files)
+
+    for _ in range(2):
+        reads, (updated_thresholds, updated_events) = run_counting_reads(
+            monkeypatch, files, str(events_file), str(thresholds_file), update=True)
+        assert reads == []
+        pd.testing.assert_frame_equal(updated_thresholds, thresholds, check_dtype=False)
+        assert len(updated_events) == len(events)
+
+
+def test_update_reads_only_the_changed_file(tmp_path, monkeypatch):
+    files = make_station_files(tmp_path, n=4)
+    events_file, thresholds_file = tmp_path / 'extreme_events.csv', tmp_path / 'thresholds.csv'
+    run_counting_reads(monkeypatch, files, str(events_file), str(thresholds_file))
+
+    with open(files[2], 'a') as f:
+        f.write('2015-02-01 00:00:00,ARG SYNTHETIC 0002,0.0\n')
+    reads, _ = run_counting_reads(monkeypatch, files, str(events_file), str(thresholds_file), update=True)
+    assert reads == [files[2]]
+
+
+def test_padded_station_names_are_stripped(tmp_path, monkeypatch):
+    files = make_station_files(tmp_path, n=2)
+    padded = pd.read_csv(files[0]).assign(station=lambda df: ' ' + df['station'] + '  ')
+    padded.to_csv(files[0], index=False)
+
+    _, (thresholds, events) = run_counting_reads(
+        monkeypatch, files, str(tmp_path / 'extreme_events.csv'), str(tmp_path / 'thresholds.csv'))
+    assert thresholds['station'].tolist() == ['ARG SYNTHETIC 0000', 'ARG SYNTHETIC 0001']
+    assert set(events['station']) == {'ARG SYNTHETIC 0000', 'ARG SYNTHETIC 0001'}
+
+
+def test_update_keeps_the_events_of_a_full_run(tmp_path, monkeypatch):
+    files = make_station_files(tmp_path, n=3)
+    events_file, thresholds_file = tmp_path / 'extreme_events.csv', tmp_path / 'thresholds.csv'
+
+    # Logger exports have records with no station name, some of them extreme
+    unnamed = pd.read_csv(files[1])
+    unnamed.loc[unnamed['rr'].nlargest(5).index, 'station'] = np.nan
+    unnamed.to_csv(files[1], index=False)
+
+    _, (_, events) = run_counting_reads(monkeypatch, files, str(events_file), str(thresholds_file))
+    assert events['station'].notna().all() and 'nan' not in set(events['station'])
+
+    os.utime(files[1])
+    reads, (_, updated_events) = run_counting_reads(
+        monkeypatch, files, str(events_file), str(thresholds_file), update=True)
+    assert reads == [files[1]]
+    pd.testing.assert_frame_equal(updated_events, events)
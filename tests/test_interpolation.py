@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from era5_utils import build_station_index, haversine_km, interpolate_stations, select_stations
+
+# Part of the 0.25 degree ERA5 grid, north to south like the real files
+latitudes = np.arange(2.0, -2.01, -0.25)
+longitudes = np.arange(98.0, 102.01, 0.25)
+
+stations = pd.DataFrame({
+    'station': ['between cells', 'on a grid point', 'on a cell edge'],
+    'latitude': [-0.37, 0.5, 1.1],
+    'longitude': [100.61, 99.25, 98.75],
+})
+
+
+# Function to make a (time, level, latitude, longitude) field, linear in latitude and longitude at every step
+def linear_field(n_time=10):
+    time = pd.date_range('2016-01-01', periods=n_time, freq='h')
+    level = [500, 850]
+    slope = np.arange(n_time * len(level), dtype=float).reshape(n_time, len(level), 1, 1)
+    values = 300 + slope * latitudes[:, None] - 2 * slope * longitudes[None, :] / 10
+    return xr.DataArray(values, dims=('time', 'level', 'latitude', 'longitude'),
+                        coords={'time': time, 'level': level, 'latitude': latitudes, 'longitude': longitudes}, name='t')
+
+
+@pytest.fixture
+def station_index(tmp_path):
+    grid_file = tmp_path / 'grid.nc'
+    linear_field().isel(time=0, level=0).to_dataset().to_netcdf(grid_file)
+    return build_station_index(stations, str(grid_file), str(tmp_path / 'station_grid_index.csv'))
+
+
+def test_weights_sum_to_one(station_index):
+    for method in ('bilinear', 'idw'):
+        weights = station_index[[f"{method}_w{k}" for k in range(4)]].values
+        np.testing.assert_allclose(weights.sum(axis=1), 1.0)
+        assert (weights >= 0).all()
+
+
+def test_bilinear_matches_linear_interpolation(station_index):
+    da = linear_field()
+    interpolated = interpolate_stations(da, station_index, 'bilinear', chunk_size=3)
+    expected = da.interp(latitude=xr.DataArray(stations['latitude'], dims='station'),
+                         longitude=xr.DataArray(stations['longitude'], dims='station'))
+
+    assert interpolated.dims == ('time', 'level', 'station')
+    np.testing.assert_allclose(interpolated.values, expected.transpose('time', 'level', 'station').values)
+    assert interpolated['station'].values.tolist() == stations['station'].tolist()
+
+
+def test_idw_weights_follow_inverse_squared_distance(station_index):
+    row = station_index.iloc[0]
+    corners = [(row.lat_idx0, row.lon_idx0), (row.lat_idx0, row.lon_idx1), (row.lat_idx1, row.lon_idx0), (row.lat_idx1, row.lon_idx1)]
+    inverse = np.array([1 / haversine_km(row.latitude, row.longitude, latitudes[i], longitudes[j]) ** 2 for i, j in corners])
+    np.testing.assert_allclose([row[f"idw_w{k}"] for k in range(4)], inverse / inverse.sum())
+
+    # A station on a grid point takes that point's value
+    da = linear_field()
+    idw = interpolate_stations(da, station_index, 'idw')
+    nearest = select_stations(da, station_index, 'nearest')
+    np.testing.assert_allclose(idw.sel(station='on a grid point').values,
+                               nearest.sel(station='on a grid point').values)
+
+
+def test_regional_cache_offsets(station_index):
+    da = linear_field()
+    region = da.isel(latitude=slice(2, None), longitude=slice(3, None))
+    region.attrs.update(lat_offset=2, lon_offset=3)
+    for method in ('bilinear', 'idw'):
+        np.testing.assert_allclose(interpolate_stations(region, station_index, method).values,
+                                   interpolate_stations(da, station_index, method).values)
@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import era5_utils
+from era5_utils import Manifest, build_station_index, get_netcdf_file, run_all_days
+
+latitudes = np.arange(2.0, -2.01, -0.25)
+longitudes = np.arange(98.0, 102.01, 0.25)
+
+
+@pytest.fixture
+def shard(tmp_path):
+    input_file, output_file = tmp_path / 'input.nc', tmp_path / 'part.nc'
+    input_file.write_bytes(b'era5 month')
+    output_file.write_bytes(b'partial')
+    return str(input_file), str(output_file)
+
+
+def test_recorded_shard_is_done_after_a_restart(tmp_path, shard):
+    Manifest(str(tmp_path / 'manifest.json')).record('cape_201601', [shard[0]], shard[1], {'method': 'nearest'})
+    manifest = Manifest(str(tmp_path / 'manifest.json'))
+    assert manifest.done('cape_201601', [shard[0]], {'method': 'nearest'})
+    assert not manifest.done('cape_201602', [shard[0]], {'method': 'nearest'})
+    assert not os.path.exists(tmp_path / 'manifest.json.tmp')
+
+
+@pytest.mark.parametrize('change', ['input', 'output', 'missing output', 'params'])
+def test_changed_shard_is_not_done(tmp_path, shard, change):
+    manifest = Manifest(str(tmp_path / 'manifest.json'))
+    manifest.record('cape_201601', [shard[0]], shard[1], {'method': 'nearest'})
+    params = {'method': 'nearest'}
+    if change == 'input':
+        with open(shard[0], 'ab') as f:
+            f.write(b' updated')
+    elif change == 'output':
+        with open(shard[1], 'wb') as f:
+            f.write(b'truncated')
+    elif change == 'missing output':
+        os.remove(shard[1])
+    else:
+        params = {'method': 'bilinear'}
+    assert not manifest.done('cape_201601', [shard[0]], params)
+
+
+# Function to write one synthetic month of CAPE in the ERA5 layout
+def write_month(year, month, days=3):
+    time = pd.date_range(f"{year}-{month:02d}-01", periods=days * 24, freq='h')
+    values = np.random.default_rng(month).gamma(1.5, 400.0, (len(time), len(latitudes), len(longitudes)))
+    nc_file = get_netcdf_file('cape', year, month)
+    os.makedirs(os.path.dirname(nc_file), exist_ok=True)
+    xr.Dataset({'cape': (('time', 'latitude', 'longitude'), values.astype('float32'))},
+               coords={'time': time, 'latitude': latitudes, 'longitude': longitudes}).to_netcdf(nc_file)
+    return nc_file
+
+
+def test_rerun_extracts_only_missing_or_changed_shards(tmp_path, monkeypatch):
+    monkeypatch.setattr(era5_utils, 'era5_dir', str(tmp_path / 'era5'))
+    monkeypatch.setattr(era5_utils, 'cache_dir', str(tmp_path / 'zarr'))
+    files = [write_month(2016, month) for month in (1, 2, 3)]
+    stations = build_station_index(pd.DataFrame({'station': ['A', 'B'], 'latitude': [-0.3, 1.1], 'longitude': [100.6, 99.0]}),
+                                   files[0], str(tmp_path / 'station_grid_index.csv'))
+
+    extracted = []
+    extract_shard = era5_utils.extract_shard
+
+    # Months with no ERA5 file are tried on every run; only shards that produce a partial are counted
+    def counting(var, year, month, *args):
+        part_file = extract_shard(var, year, month, *args)
+        if part_file is not None:
+            extracted.append((year, month))
+        return part_file
+
+    monkeypatch.setattr(era5_utils, 'extract_shard', counting)
+    outputs = {'cape': str(tmp_path / 'cape_all_days.nc')}
+    run_all_days(outputs, stations, years=range(2016, 2017), parts_dir=str(tmp_path / 'parts'))
+    assert extracted == [(2016, 1), (2016, 2), (2016, 3)]
+    with xr.open_dataset(outputs['cape']) as ds:
+        first = ds.load()
+
+    # A restarted job redoes nothing, a changed month is extracted again, and so is every month for other stations
+    extracted.clear()
+    run_all_days(outputs, stations, years=range(2016, 2017), parts_dir=str(tmp_path / 'parts'))
+    assert extracted == []
+
+    os.utime(files[1], ns=(0, 0))
+    run_all_days(outputs, stations, years=range(2016, 2017), parts_dir=str(tmp_path / 'parts'))
+    assert extracted == [(2016, 2)]
+
+    extracted.clear()
+    run_all_days(outputs, stations.iloc[:1], years=range(2016, 2017), parts_dir=str(tmp_path / 'parts'))
+    assert extracted == [(2016, 1), (2016, 2), (2016, 3)]
+
+    run_all_days(outputs, stations, years=range(2016, 2017), parts_dir=str(tmp_path / 'parts'))
+    with xr.open_dataset(outputs['cape']) as ds:
+        xr.testing.assert_identical(ds.load(), first)
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import stability
+from stability import (INDICES, kappa, lift_parcel, magnus_dewpoint, saturation_vapor_pressure, stability_indices,
+                       stability_levels)
+
+# A moist tropical sounding (degrees C and dew points) on stability_levels: 300, 500, 700, 850, 925, 1000 hPa
+sounding_t = np.array([-32.0, -6.0, 9.0, 18.0, 22.0, 26.0])
+sounding_td = np.array([-45.0, -20.0, 2.0, 15.0, 19.0, 23.0])
+
+
+# Function to turn dew points into the relative humidity ERA5 gives, with the same Magnus formula
+def relative_humidity(t_c, td_c):
+    return 100 * saturation_vapor_pressure(td_c) / saturation_vapor_pressure(t_c)
+
+
+# Function to make (time, station, level) t (K) and r (%) profiles, every column the sounding shifted by `offsets`
+def profiles(offsets):
+    offsets = np.asarray(offsets, dtype=float)
+    t = sounding_t + offsets[..., None]
+    r = relative_humidity(t, sounding_td + offsets[..., None])
+    coords = {'time': pd.date_range('2016-01-01', periods=offsets.shape[0], freq='h'),
+              'station': [f"S{i}" for i in range(offsets.shape[1])], 'level': stability_levels}
+    dims = ('time', 'station', 'level')
+    return xr.DataArray(t + 273.15, dims=dims, coords=coords), xr.DataArray(r, dims=dims, coords=coords)
+
+
+# Function to compute the equivalent potential temperature (K) of Bolton (1980), conserved along a pseudoadiabat
+def theta_e(p, t, td):
+    e = saturation_vapor_pressure(td - 273.15)
+    r = 622 * e / (p - e)
+    t_lcl = 1 / (1 / (td - 56) + np.log(t / td) / 800) + 56
+    return t * (1000 / p) ** (0.2854 * (1 - 0.28e-3 * r)) * np.exp((3.376 / t_lcl - 0.00254) * r * (1 + 0.81e-3 * r))
+
+
+def test_magnus_dewpoint_inverts_the_humidity():
+    t = np.array([-20.0, 0.0, 15.0, 30.0])
+    td = np.array([-25.0, -8.0, 15.0, 21.0])
+    np.testing.assert_allclose(magnus_dewpoint(t, relative_humidity(t, td)), td, atol=1e-10)
+
+    # Supersaturation (over ice) and zero humidity stay finite and at or below T
+    assert (magnus_dewpoint(t, np.array([105.0, 0.0, 100.0, 120.0])) <= t + 1e-10).all()
+    assert np.isfinite(magnus_dewpoint(t, np.zeros(4))).all()
+
+
+def test_k_index_and_total_totals_by_hand():
+    t, r = profiles(np.zeros((1, 1)))
+    out = stability_indices(t, r, ['K_index', 'total_totals'])
+    t850, t700, t500 = 18.0, 9.0, -6.0
+    td850, td700 = 15.0, 2.0
+    np.testing.assert_allclose(out['K_index'].item(), (t850 - t500) + td850 - (t700 - td700))
+    np.testing.assert_allclose(out['total_totals'].item(), t850 + td850 - 2 * t500)
+
+
+def test_lifted_parcel_keeps_its_equivalent_potential_temperature():
+    t0 = np.array([293.15, 300.0, 303.0])
+    td0 = np.array([293.15, 295.0, 290.0])
+    p0 = np.array([850.0, 1000.0, 962.5])
+    parcel = lift_parcel(p0, t0, td0, 500.0)
+    np.testing.assert_allclose(theta_e(500.0, parcel, parcel), theta_e(p0, t0, td0), atol=1.0)
+
+
+def test_lifted_parcel_steps_have_converged(monkeypatch):
+    t0, td0 = np.array([300.0]), np.array([295.0])
+    parcel = lift_parcel(1000.0, t0, td0, 500.0)
+    monkeypatch.setattr(stability, 'moist_steps', 4 * stability.moist_steps)
+    np.testing.assert_allclose(lift_parcel(1000.0, t0, td0, 500.0), parcel, atol=0.01)
+
+
+def test_dry_parcel_follows_the_dry_adiabat():
+    # So dry that it saturates above 500 hPa
+    t0, td0 = np.array([300.0]), np.array([235.0])
+    np.testing.assert_allclose(lift_parcel(1000.0, t0, td0, 500.0), t0 * 0.5 ** kappa)
+
+
+def test_lifted_and_showalter_indices():
+    t, r = profiles(np.zeros((1, 1)))
+    out = stability_indices(t, r, ['lifted_index', 'showalter'])
+    t500 = -6.0 + 273.15
+    showalter_parcel = lift_parcel(850.0, 18.0 + 273.15, 15.0 + 273.15, 500.0)
+    lifted_parcel = lift_parcel(962.5, (22.0 + 26.0) / 2 + 273.15, (19.0 + 23.0) / 2 + 273.15, 500.0)
+    np.testing.assert_allclose(out['showalter'].item(), t500 - showalter_parcel)
+    np.testing.assert_allclose(out['lifted_index'].item(), t500 - lifted_parcel)
+
+    # A moist tropical column is unstable to the near-surface parcel
+    assert out['lifted_index'].item() < 0
+
+
+def test_precipitable_water_integrates_specific_humidity():
+    t, r = profiles(np.zeros((1, 1)))
+    levels = np.array(stability_levels, dtype=float)
+    e = saturation_vapor_pressure(sounding_td)
+    q = 0.622 * e / (levels - 0.378 * e)
+    expected = np.trapezoid(q, levels * 100) / 9.80665
+    np.testing.assert_allclose(stability_indices(t, r, ['pw_proxy'])['pw_proxy'].item(), expected)
+
+
+def test_indices_keep_the_other_dimensions():
+    offsets = np.arange(12, dtype=float).reshape(4, 3) - 6
+    t, r = profiles(offsets)
+    out = stability_indices(t, r)
+
+    assert list(out.data_vars) == list(INDICES)
+    for name in INDICES:
+        assert out[name].dims == ('time', 'station')
+        assert out[name].attrs['units']
+
+    # Every column on its own gives the same values
+    column = stability_indices(t.isel(time=[2], station=[1]), r.isel(time=[2], station=[1]))
+    for name in INDICES:
+        np.testing.assert_allclose(out[name].isel(time=2, station=1).item(), column[name].item())
+
+
+def test_unknown_index_is_refused():
+    t, r = profiles(np.zeros((1, 1)))
+    with pytest.raises(KeyError):
+        stability_indices(t, r, ['K_index', 'cape'])
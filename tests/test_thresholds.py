@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from precipitation_utils import ExactQuantiles, QuantileSketch, compute_thresholds
+
+quantiles = np.array([0.0, 0.5, 0.9, 0.99, 0.999, 1.0])
+
+
+# Function to draw 10-minute rainfall: mostly dry, gamma-distributed rain to 0.1 mm, some records missing
+def rainfall(n, seed=0):
+    rng = np.random.default_rng(seed)
+    rr = np.where(rng.random(n) < 0.05, np.round(rng.gamma(0.6, 3.0, n), 1), 0.0)
+    rr[rng.random(n) < 0.02] = np.nan
+    return rr
+
+
+def test_exact_quantiles_match_pandas():
+    rr = rainfall(200_000)
+    accumulator = ExactQuantiles()
+    for chunk in np.array_split(rr, 7):
+        accumulator.update(chunk)
+    np.testing.assert_allclose(accumulator.quantile(quantiles), pd.Series(rr).quantile(quantiles).values)
+    assert accumulator.count == np.isfinite(rr).sum()
+
+
+def test_sketch_is_within_its_relative_accuracy():
+    rr = rainfall(200_000, seed=1)
+    sketch = QuantileSketch(relative_accuracy=0.005)
+    sketch.update(rr)
+    expected = pd.Series(rr).quantile(quantiles).values
+    np.testing.assert_allclose(sketch.quantile(quantiles), expected, rtol=0.005)
+    assert sketch.quantile(0.5) == 0.0
+
+
+@pytest.mark.parametrize('method', [ExactQuantiles, QuantileSketch])
+def test_merged_accumulators_equal_one_pass(method):
+    rr = rainfall(50_000, seed=2)
+    whole, parts = method(), [method() for _ in range(3)]
+    whole.update(rr)
+    for part, chunk in zip(parts, np.array_split(rr, 3)):
+        part.update(chunk)
+    merged = parts[2]
+    merged.merge(parts[0])
+    merged.merge(parts[1])
+
+    assert merged.count == whole.count
+    np.testing.assert_array_equal(merged.quantile(quantiles), whole.quantile(quantiles))
+
+
+@pytest.mark.parametrize('method', [ExactQuantiles, QuantileSketch])
+def test_empty_accumulator_gives_nan(method):
+    accumulator = method()
+    accumulator.update(np.array([np.nan]))
+    assert np.isnan(accumulator.quantile(quantiles)).all()
+
+
+def test_sketches_of_different_accuracy_do_not_merge():
+    with pytest.raises(ValueError):
+        QuantileSketch(0.005).merge(QuantileSketch(0.01))
+
+
+def test_padded_station_names_are_merged(tmp_path):
+    dates = pd.date_range('2015-01-01', periods=1000, freq='10min')
+    rr = np.arange(2000) / 10
+    paths = []
+    for year, (name, values) in enumerate([('ARG PADDED 0001 ', rr[:1000]), ('ARG PADDED 0001', rr[1000:])]):
+        path = tmp_path / f"ARG PADDED 0001_{2015 + year}_10m.csv"
+        pd.DataFrame({'date': dates, 'station': name, 'rr': values}).to_csv(path, index=False)
+        paths.append(str(path))
+
+    thresholds = compute_thresholds(paths, percentiles=[50], method='exact', workers=1)
+    assert thresholds['station'].tolist() == ['ARG PADDED 0001']
+    assert thresholds['50th percentile'].iloc[0] == round(np.percentile(rr, 50), 2)
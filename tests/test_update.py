@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import era5_utils
+from era5_utils import VARIABLES, build_station_index, get_netcdf_file, run_all_days
+
+latitudes = np.arange(2.0, -2.01, -0.25)
+longitudes = np.arange(98.0, 102.01, 0.25)
+stations = pd.DataFrame({'station': ['A', 'B', 'C'], 'latitude': [-0.3, 1.1, 0.5], 'longitude': [100.6, 99.0, 101.2]})
+
+
+# Function to write one synthetic month of a single-level or pressure-level variable in the ERA5 layout
+def write_month(era5_dir, var, year, month, days=3):
+    time = pd.date_range(f"{year}-{month:02d}-01", periods=days * 24, freq='h')
+    rng = np.random.default_rng([month, len(var)])
+    coords = {'time': time, 'latitude': latitudes, 'longitude': longitudes}
+    dims, shape = ('time', 'latitude', 'longitude'), (len(time), len(latitudes), len(longitudes))
+    values = rng.gamma(1.5, 400.0, shape)
+    if VARIABLES[var]['level_type'] == 'pressure-levels':
+        coords['level'] = VARIABLES[var]['levels']
+        dims, shape = ('time', 'level', 'latitude', 'longitude'), (len(time), len(coords['level'])) + shape[1:]
+        values = rng.normal(260.0, 20.0, shape)
+
+    era5_utils.era5_dir = era5_dir
+    nc_file = get_netcdf_file(var, year, month)
+    os.makedirs(os.path.dirname(nc_file), exist_ok=True)
+    xr.Dataset({var: (dims, values.astype('float32'))}, coords=coords).to_netcdf(nc_file)
+    return nc_file
+
+
+# Function to run the all-days extraction of 2016 on the months in `era5_dir`
+def run(tmp_path, era5_dir, name, update=False):
+    era5_utils.era5_dir = str(era5_dir)
+    outputs = {var: str(tmp_path / name / f"{var}_all_days.nc") for var in ('cape', 't')}
+    os.makedirs(tmp_path / name, exist_ok=True)
+    index = build_station_index(stations, get_netcdf_file('cape', 2016, 1), str(tmp_path / 'station_grid_index.csv'))
+    run_all_days(outputs, index, years=range(2016, 2017), parts_dir=str(tmp_path / name / 'parts'), update=update)
+    results = {}
+    for var, path in outputs.items():
+        with xr.open_dataset(path) as ds:
+            results[var] = ds.load()
+    return results
+
+
+# The tests point era5_utils at several synthetic ERA5 directories; the paths are restored afterwards
+@pytest.fixture(autouse=True)
+def no_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(era5_utils, 'era5_dir', era5_utils.era5_dir)
+    monkeypatch.setattr(era5_utils, 'cache_dir', str(tmp_path / 'zarr'))
+
+
+def test_update_matches_a_full_run(tmp_path):
+    for var in ('cape', 't'):
+        for month in (1, 2, 3):
+            write_month(str(tmp_path / 'full'), var, 2016, month)
+            if month < 3:
+                write_month(str(tmp_path / 'growing'), var, 2016, month)
+    full = run(tmp_path, tmp_path / 'full', 'full')
+
+    # The later run only has the new month to extract, and adds it to what is there
+    run(tmp_path, tmp_path / 'growing', 'updated')
+    for var in ('cape', 't'):
+        write_month(str(tmp_path / 'growing'), var, 2016, 3)
+    updated = run(tmp_path, tmp_path / 'growing', 'updated', update=True)
+    assert sorted(os.listdir(tmp_path / 'updated' / 'parts' / 'cape')) == ['cape_201601.nc', 'cape_201602.nc', 'cape_201603.nc']
+
+    xr.testing.assert_identical(updated['cape'], full['cape'])
+    assert updated['cape'].attrs['last_month'] == '2016-03'
+    assert updated['t']['count'].values.tolist() == full['t']['count'].values.tolist()
+    xr.testing.assert_allclose(updated['t'], full['t'])
+
+
+def test_update_with_nothing_new_keeps_the_output(tmp_path):
+    for var in ('cape', 't'):
+        write_month(str(tmp_path / 'era5'), var, 2016, 1)
+    first = run(tmp_path, tmp_path / 'era5', 'output')
+    again = run(tmp_path, tmp_path / 'era5', 'output', update=True)
+    for var in first:
+        xr.testing.assert_identical(again[var], first[var])